@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+# run.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Benchmarks of the source tree, run from a checkout without installing:
+#
+#   benchmarks/run.py -o before.json
+#   benchmarks/run.py -o after.json --compare before.json
+#
+# The engine, classify, batch and serve groups only need Python (and NumPy
+# for the vectorized parts), serve load-tests 'bmi --serve' on a free port of
+# this host with and without micro-batching. The startup and interaction groups need PyGObject with
+# GTK 4 and libadwaita and a display: the current one, Xvfb through xvfb-run
+# or the Broadway backend, in that order. Groups which can't run are recorded
+# as skipped with the reason.
+
+# Imports
+import argparse
+import asyncio
+import gettext
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src = os.path.join(root, 'src')
+GROUPS = ['engine', 'classify', 'batch', 'serve', 'startup', 'interaction']
+
+# Makes the source directory importable as the 'bmi' package, the way it is
+# installed, and installs _() like the launcher does
+def load_package():
+    if 'bmi' not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            'bmi', os.path.join(src, '__init__.py'), submodule_search_locations=[src]
+        )
+        package = importlib.util.module_from_spec(spec)
+        sys.modules['bmi'] = package
+        spec.loader.exec_module(package)
+    gettext.install('bmi')
+
+# Returns the best time of repeat runs of function in seconds
+def best_of(function, repeat):
+    times = []
+    for _run in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+# Summarises latencies given in seconds, in milliseconds
+def summarise(samples):
+    samples = sorted(samples)
+    def percentile(fraction):
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)] * 1000
+    return {
+        'samples': len(samples),
+        'min_ms': samples[0] * 1000,
+        'p50_ms': percentile(0.5),
+        'p99_ms': percentile(0.99),
+        'max_ms': samples[-1] * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+    }
+
+# Random but reproducible measurements as columns
+def generate_inputs(rows, seed=1):
+    generator = random.Random(seed)
+    return [
+        [round(generator.uniform(120, 220), 1) for _row in range(rows)],
+        [round(generator.uniform(30, 200), 1) for _row in range(rows)],
+        [round(generator.uniform(40, 150), 1) for _row in range(rows)],
+        [round(generator.uniform(60, 160), 1) for _row in range(rows)],
+        [generator.randint(18, 90) for _row in range(rows)],
+        [generator.randint(0, 2) for _row in range(rows)],
+    ]
+
+def bench_engine(args):
+    from bmi import engine
+    results = {}
+    rows = 2000 if args.quick else 20000
+    columns = generate_inputs(rows)
+    records = list(zip(*columns))
+    def scalar():
+        for record in records:
+            engine.compute(*record)
+    results['compute_scalar'] = {'rows': rows, 'rows_per_s': rows / best_of(scalar, args.repeat)}
+
+    # The window's path, where most inputs repeat
+    window_records = records[:100] * (rows // 100)
+    def cached():
+        engine.compute_quantized.cache_clear()
+        for record in window_records:
+            engine.compute_cached(*record)
+    results['compute_cached'] = {
+        'rows': len(window_records), 'distinct': 100,
+        'rows_per_s': len(window_records) / best_of(cached, args.repeat),
+    }
+
+    if engine.np is None:
+        results['compute_batch'] = {'skipped': "NumPy is not installed"}
+        return results
+    for size in ([10000] if args.quick else [10000, 1000000]):
+        arrays = [engine.np.array(column * (size // rows)) for column in columns]
+        seconds = best_of(lambda: engine.compute_batch(*arrays), args.repeat)
+        results[f'compute_batch_{size}'] = {'rows': size, 'rows_per_s': size / seconds}
+    return results
+
+def bench_classify(args):
+    from bmi import engine
+    results = {}
+    rows = 5000 if args.quick else 50000
+    height, mass, waist, hip, age, gender = generate_inputs(rows, seed=2)
+    values = {
+        'bmi': [m / (h / 100) ** 2 for h, m in zip(height, mass)],
+        'whtr': [w / h for w, h in zip(waist, height)],
+        'whr': [w / h for w, h in zip(waist, hip)],
+        'bri': [engine.get_bri(h, w) for h, w in zip(height, waist)],
+    }
+    for metric, column in values.items():
+        def scalar():
+            for value, years, index in zip(column, age, gender):
+                engine.classify(metric, value, years, index)
+        results[f'{metric}_scalar'] = {'rows': rows, 'rows_per_s': rows / best_of(scalar, args.repeat)}
+        if engine.np is not None:
+            arrays = [engine.np.array(column), engine.np.array(age), engine.np.array(gender)]
+            seconds = best_of(lambda: engine.classify_batch(metric, *arrays), args.repeat)
+            results[f'{metric}_batch'] = {'rows': rows, 'rows_per_s': rows / seconds}
+    return results
+
+def bench_batch(args):
+    from bmi import batch, engine
+    if engine.np is None:
+        return {'skipped': "NumPy is not installed"}
+    rows = 10000 if args.quick else 200000
+    text = "height,mass,waist,hip,age,gender\n" + "".join(
+        f"{h},{m},{w},{p},{a},{['average', 'female', 'male'][g]}\n"
+        for h, m, w, p, a, g in zip(*generate_inputs(rows, seed=3))
+    )
+    def run():
+        batch.run(io.StringIO(text), io.StringIO(), 'csv', 'csv')
+    return {'csv_to_csv': {'rows': rows, 'rows_per_s': rows / best_of(run, args.repeat)}}
+
+# Concurrent keep-alive clients each sending their records one request at a
+# time, a max_batch of 1 scores every request on its own
+def bench_serve(args):
+    from bmi import engine, server
+    if engine.np is None:
+        return {'skipped': "NumPy is not installed"}
+    clients = 64
+    requests = 20 if args.quick else 200
+    columns = generate_inputs(clients * requests, seed=4)
+    records = [dict(zip(server.batch.INPUTS, row)) for row in zip(*columns)]
+
+    async def client(port, records, latencies):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for record in records:
+            body = json.dumps(record).encode()
+            start = time.perf_counter()
+            writer.write(f"POST /compute HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    async def load(instance):
+        stop = asyncio.Event()
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(instance.serve('127.0.0.1', 0, stop, ready.set_result))
+        port = await ready
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            client(port, records[index::clients], latencies) for index in range(clients)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+        return elapsed, latencies
+
+    results = {}
+    for name, max_batch in [('unbatched', 1), ('batched', 256)]:
+        instance = server.Server(max_batch=max_batch, max_wait=0.002)
+        elapsed, latencies = asyncio.run(load(instance))
+        results[name] = {
+            'rows': len(records),
+            'rows_per_s': len(records) / elapsed,
+            'mean_batch_rows': instance.stats.get_summary()['mean_batch_rows'],
+            'client': summarise(latencies),
+        }
+    return results
+
+# Returns (command prefix, environment) to run GTK on, or raises
+# RuntimeError if there's no display to be had
+def get_display(servers):
+    environment = dict(os.environ)
+    if environment.get('WAYLAND_DISPLAY') or environment.get('DISPLAY'):
+        return [], environment
+    if shutil.which('xvfb-run'):
+        return ['xvfb-run', '-a'], environment
+    broadwayd = shutil.which('gtk4-broadwayd')
+    if broadwayd:
+        display = ':47'
+        server = subprocess.Popen([broadwayd, display], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        servers.append(server)
+        time.sleep(0.5)
+        environment.update(GDK_BACKEND='broadway', BROADWAY_DISPLAY=display)
+        return [], environment
+    raise RuntimeError("no display, Xvfb or Broadway available")
+
+# Runs this script in a child process for the GUI groups, with its own
+# settings, history and session bus so nothing of the user's is touched
+def run_child(mode, args):
+    try:
+        import gi
+        gi.require_version('Gtk', '4.0')
+        gi.require_version('Adw', '1')
+    except (ImportError, ValueError) as error:
+        raise RuntimeError(f"PyGObject with GTK 4 and libadwaita is needed: {error}")
+    servers = []
+    try:
+        prefix, environment = get_display(servers)
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess.run(
+                ['glib-compile-schemas', '--targetdir', directory, os.path.join(root, 'data')],
+                check=True,
+            )
+            environment.update(
+                GSETTINGS_SCHEMA_DIR=directory, GSETTINGS_BACKEND='memory',
+                XDG_DATA_HOME=directory, NO_AT_BRIDGE='1',
+            )
+            if shutil.which('dbus-run-session'):
+                prefix = ['dbus-run-session', '--'] + prefix
+            command = prefix + [sys.executable, os.path.abspath(__file__), f'--child={mode}']
+            if args.quick:
+                command.append('--quick')
+            samples = []
+            for _run in range(args.repeat if mode == 'startup' else 1):
+                start = time.monotonic()
+                output = subprocess.run(
+                    command, env=environment, capture_output=True, text=True, timeout=120
+                )
+                if output.returncode != 0:
+                    errors = output.stderr.strip().splitlines()
+                    raise RuntimeError(errors[-1] if errors else f"{mode} child failed")
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                result['start'] = start
+                samples.append(result)
+            return samples
+    except (OSError, subprocess.SubprocessError) as error:
+        raise RuntimeError(str(error))
+    finally:
+        for server in servers:
+            server.terminate()
+
+def bench_startup(args):
+    samples = run_child('startup', args)
+    return {
+        'first_frame': summarise([sample['frame'] - sample['start'] for sample in samples]),
+        'imports': summarise([sample['imports'] for sample in samples]),
+    }
+
+def bench_interaction(args):
+    return run_child('interaction', args)[0]['results']
+
+# Child side of the startup group: runs main.main() until the first frame of
+# the window is painted and prints when that was
+def child_startup():
+    start = time.perf_counter()
+    load_package()
+    import gi
+    gi.require_version('Gtk', '4.0')
+    from gi.repository import GObject, Gtk
+    from bmi import main
+    imports = time.perf_counter() - start
+    def on_map(window, *args):
+        def on_after_paint(clock):
+            print(json.dumps({'frame': time.monotonic(), 'imports': imports}), flush=True)
+            window.get_application().quit()
+        window.get_frame_clock().connect('after-paint', on_after_paint)
+        return False
+    GObject.add_emission_hook(Gtk.Window, 'map', on_map)
+    sys.argv = sys.argv[:1]
+    return main.main(None)
+
+# Child side of the interaction group: changes spin rows the way holding a
+# key does and measures until the results are shown
+def child_interaction(quick):
+    load_package()
+    import gi
+    gi.require_version('Gtk', '4.0')
+    gi.require_version('Adw', '1')
+    from gi.repository import Adw, GLib
+    from bmi.window import BmiWindow
+    Adw.init()
+    context = GLib.MainContext.default()
+    events = 100 if quick else 1000
+
+    window = BmiWindow()
+    window.present()
+    while not window.get_mapped():
+        context.iteration(True)
+
+    def drive(row, values):
+        # From a change to the update on the next frame, as seen by the user
+        frame = []
+        for value in values:
+            start = time.perf_counter()
+            row.set_value(value)
+            while window.input_tick is not None:
+                context.iteration(True)
+            frame.append(time.perf_counter() - start)
+        # The same changes handled right away, without waiting for a frame
+        handler = []
+        for value in values:
+            start = time.perf_counter()
+            row.set_value(value)
+            window.flush_inputs()
+            handler.append(time.perf_counter() - start)
+        return {'to_frame': summarise(frame), 'handler': summarise(handler)}
+
+    results = {}
+    heights = [150 + (index % 400) / 10 for index in range(events)]
+    results['basic_height'] = drive(window.height_input_row, heights)
+    start = time.perf_counter()
+    window.mode_dropdown.set_selected(1)
+    results['build_advanced_ms'] = (time.perf_counter() - start) * 1000
+    results['advanced_height'] = drive(window.height_input_row, heights)
+    results['advanced_waist'] = drive(window.waist_input_row, [60 + value - 150 for value in heights])
+    start = time.perf_counter()
+    window.units_button.set_active(True)
+    results['units_toggle_ms'] = (time.perf_counter() - start) * 1000
+    print(json.dumps({'results': results}), flush=True)
+    window.destroy()
+    return 0
+
+benchmarks = {
+    'engine': bench_engine,
+    'classify': bench_classify,
+    'batch': bench_batch,
+    'serve': bench_serve,
+    'startup': bench_startup,
+    'interaction': bench_interaction,
+}
+
+def get_commit():
+    try:
+        output = subprocess.run(
+            ['git', '-C', root, 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        )
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Yields (group/name/field, new / old) of the throughputs and latencies found
+# in both results
+def compare(old, new):
+    for group, results in new['results'].items():
+        for name, values in results.items():
+            previous = old.get('results', {}).get(group, {}).get(name)
+            if not isinstance(values, dict) or not isinstance(previous, dict):
+                continue
+            if 'rows_per_s' in values and 'rows_per_s' in previous:
+                yield f"{group}/{name}", "throughput", values['rows_per_s'] / previous['rows_per_s']
+            for latency in ('to_frame', 'handler', 'client'):
+                if latency in values and latency in previous:
+                    ratio = values[latency]['p50_ms'] / previous[latency]['p50_ms']
+                    yield f"{group}/{name}/{latency}", "p50 latency", ratio
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks of the BMI source tree")
+    parser.add_argument('-o', '--output', help="file to write the JSON results to, stdout by default")
+    parser.add_argument('--only', default=','.join(GROUPS),
+                        help=f"comma separated groups to run, out of {', '.join(GROUPS)}")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="runs per benchmark, the best or all of them are reported")
+    parser.add_argument('--quick', action='store_true', help="use smaller inputs")
+    parser.add_argument('--compare', metavar='JSON', help="earlier results to compare against")
+    parser.add_argument('--child', choices=['startup', 'interaction'], help=argparse.SUPPRESS)
+    return parser
+
+def main():
+    args = create_parser().parse_args()
+    if args.child == 'startup':
+        return child_startup()
+    if args.child == 'interaction':
+        return child_interaction(args.quick)
+
+    load_package()
+    from bmi import engine
+    report = {
+        'commit': get_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': engine.np.__version__ if engine.np is not None else None,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'repeat': args.repeat,
+        'results': {},
+    }
+    for group in args.only.split(','):
+        if group not in benchmarks:
+            sys.exit(f"unknown group '{group}'")
+        print(f"Running {group}...", file=sys.stderr)
+        try:
+            report['results'][group] = benchmarks[group](args)
+        except RuntimeError as error:
+            report['results'][group] = {'skipped': str(error)}
+
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)
+        print(f"Compared to {old.get('commit') or args.compare}:", file=sys.stderr)
+        for name, kind, ratio in compare(old, report):
+            print(f"  {name:<40} {kind:<12} {ratio:6.2f}x", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,410 @@
+# batch.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Headless batch mode, started with 'bmi --batch'. Reads CSV or JSONL
+# measurement records and streams them back out with the results appended,
+# a chunk at a time so memory use does not grow with the input. Nothing in
+# here may import Gtk/Adw.
+
+# Imports
+import argparse
+import collections
+import concurrent.futures
+import csv
+import io
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from . import columnar, engine, labels
+
+# Guessing the format from a file name, stdin defaults to CSV
+def guess_format(path):
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+def guess_output_format(path, input_format):
+    return columnar.EXTENSIONS.get(os.path.splitext(path)[1], input_format)
+
+# Conversions of the imperial inputs to centimetres and kilograms
+imperial_conversions = {
+    'height': engine.in_to_cm,
+    'mass':   engine.lb_to_kg,
+    'waist':  engine.in_to_cm,
+    'hip':    engine.in_to_cm,
+}
+
+# Returns the input values of a record in centimetres and kilograms. Only
+# given values are converted from imperial units, the defaults are metric.
+def parse_record(record, imperial):
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    values = []
+    # The fields of engine.INPUTS, the ones in engine.DEFAULTS may be left
+    # out of a record
+    for field in engine.INPUTS:
+        value = record.get(field)
+        if value is None or value == '':
+            if field not in engine.DEFAULTS:
+                raise ValueError(f"missing '{field}'")
+            value = engine.DEFAULTS[field]
+        elif field == 'gender':
+            value = engine.parse_gender(value)
+        else:
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError(f"'{field}' is not a finite number")
+            if field == 'age' and value < 0:
+                raise ValueError("'age' is negative")
+            if field != 'age' and value <= 0:
+                raise ValueError(f"'{field}' is not positive")
+            if imperial and field in imperial_conversions:
+                value = imperial_conversions[field](value)
+        values.append(value)
+    return values
+
+# Returns the object on a JSONL line, errors name the record number
+def parse_json_record(line, record):
+    try:
+        value = json.loads(line)
+    except ValueError as error:
+        raise ValueError(f"record {record}: {error}") from None
+    if not isinstance(value, dict):
+        raise ValueError(f"record {record}: not an object")
+    return value
+
+# Returns the input values of a list of records as columns
+def parse_columns(records, imperial=False, first_line=1):
+    columns = [[] for field in engine.INPUTS]
+    for line, record in enumerate(records, first_line):
+        try:
+            values = parse_record(record, imperial)
+        except (TypeError, ValueError, OverflowError) as error:
+            raise ValueError(f"record {line}: {error}") from None
+        for column, value in zip(columns, values):
+            column.append(value)
+    return columns
+
+# Returns engine.compute_batch() of the input columns, without NumPy the
+# same results as lists computed row by row
+def compute_columns(columns, metrics=engine.METRICS):
+    if engine.np is not None:
+        return engine.compute_batch(*columns, metrics=metrics)
+    results = {metric: ([], []) for metric in engine.get_plan(metrics).names}
+    for row in zip(*columns):
+        for metric, (value, category) in engine.compute(*row, metrics=metrics).items():
+            results[metric][0].append(value)
+            results[metric][1].append(category)
+    return results
+
+def as_list(values):
+    return values if isinstance(values, list) else values.tolist()
+
+# Scores a list of records in one vectorized pass, adding the result
+# columns to each record in place
+def score(records, imperial=False, first_line=1, metrics=engine.METRICS, languages=()):
+    columns = parse_columns(records, imperial, first_line)
+    add_results(records, columns, compute_columns(columns, metrics), languages)
+    return records
+
+# Returns the reason codes of the rows without a BRI, which are only worked
+# out for those rows, and 0 for the others
+def get_bri_reasons(columns, results):
+    np = engine.np
+    if np is None:
+        return [
+            engine.get_bri_reason(height, waist) if category == engine.INVALID else engine.BRI_VALID
+            for height, waist, category in zip(columns[0], columns[2], results['bri'][1])
+        ]
+    invalid = results['bri'][1] == engine.INVALID
+    reasons = np.zeros(len(invalid), dtype=np.int8)
+    if invalid.any():
+        height = np.asarray(columns[0], dtype=np.float64)[invalid]
+        waist = np.asarray(columns[2], dtype=np.float64)[invalid]
+        reasons[invalid] = engine.get_bri_batch(height, waist)[1]
+    return reasons
+
+# Adds the results to the records, with the labels in each of the given
+# languages in their own columns
+def add_results(records, columns, results, languages=()):
+    tables = [(f"_{language}", labels.get_table(language)) for language in languages]
+    for metric, (values, categories) in results.items():
+        values = as_list(values)
+        categories = as_list(categories)
+        # Whole numbers come as floats when a row is undefined
+        whole = engine.DIGITS[metric] == 0
+        for record, value, category in zip(records, values, categories):
+            if category == engine.INVALID:
+                record[metric] = None
+            else:
+                record[metric] = int(value) if whole else value
+        if not engine.REGISTRY[metric].bands:
+            continue
+        # engine.INVALID is -1, so it picks the label appended last
+        untranslated = [text for text, style in engine.BANDS[metric]] + [engine.INVALID_LABEL]
+        for suffix, texts in [('', untranslated)] + [(suffix, table.get_labels(metric)) for suffix, table in tables]:
+            category_column = f"{metric}_category{suffix}"
+            for record, category in zip(records, categories):
+                record[category_column] = texts[category]
+    if 'bri' not in results:
+        return
+    reasons = as_list(get_bri_reasons(columns, results))
+    for suffix, texts in [('', engine.BRI_REASONS)] + [(suffix, table.reasons) for suffix, table in tables]:
+        for record, reason in zip(records, reasons):
+            record[f'bri_reason{suffix}'] = texts[reason]
+
+# Output columns added to each record for the given metrics, a category
+# column only for metrics with bands, followed by one in each of the given
+# languages. Undefined values are left empty with the reason in 'bri_reason'.
+def get_result_columns(metrics=engine.METRICS, languages=()):
+    columns = []
+    for metric in engine.get_plan(metrics).metrics:
+        columns.append(metric.name)
+        if metric.bands:
+            columns.append(f"{metric.name}_category")
+            columns += [f"{metric.name}_category_{language}" for language in languages]
+    if 'bri' in metrics:
+        columns.append('bri_reason')
+        columns += [f"bri_reason_{language}" for language in languages]
+    return columns
+
+RESULTS = get_result_columns()
+
+def format_records(records, fields, format):
+    if format == 'jsonl':
+        return ''.join(json.dumps(record) + '\n' for record in records)
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, fields, extrasaction='ignore').writerows(records)
+    return buffer.getvalue()
+
+# Turns a chunk of JSONL lines or parsed CSV rows into output text, or a
+# structured array for the columnar formats, this is what runs in the worker
+# processes. Returns the output, the number of records in it and how many of
+# them have no BRI.
+def score_lines(lines, fields, input_format, output_format, imperial, metrics, languages, first_line):
+    if input_format == 'csv':
+        records = [dict(zip(fields, row)) for row in lines]
+    else:
+        records = [parse_json_record(line, record) for record, line in enumerate(lines, first_line)]
+    columns = parse_columns(records, imperial, first_line)
+    results = compute_columns(columns, metrics)
+    invalid = 0
+    if 'bri' in results:
+        invalid = as_list(results['bri'][1]).count(engine.INVALID)
+    if output_format in columnar.FORMATS:
+        reasons = get_bri_reasons(columns, results) if 'bri' in results else None
+        table = columnar.create_table(columns, results, reasons)
+        return table, len(records), invalid
+    add_results(records, columns, results, languages)
+    return format_records(records, fields, output_format), len(records), invalid
+
+# Writes text output, starting with the CSV header
+class TextWriter:
+    def __init__(self, stream, format, fields):
+        self.stream = stream
+        if format == 'csv':
+            csv.writer(stream).writerow(fields)
+
+    def write(self, text):
+        self.stream.write(text)
+
+    def close(self):
+        self.stream.flush()
+
+# Splits the input into chunks of lines or rows, also yielding the record
+# number each chunk starts at
+def read_chunks(lines, chunk_size):
+    first_line = 1
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk, first_line
+        first_line += len(chunk)
+
+# Scores the input a chunk at a time and writes the results in input order,
+# with more than one job the chunks are scored on a process pool. Returns the
+# number of records scored and how many of them have no BRI. Only the given
+# metrics are computed and written, with their labels also in the given
+# languages.
+def run(input, output, input_format, output_format, imperial=False, chunk_size=4096, jobs=1,
+        metrics=engine.METRICS, languages=()):
+    # The output columns are the input columns of the first record plus the
+    # results, the first JSON record is put back afterwards. CSV is chunked
+    # by parsed rows rather than lines as quoted fields may hold line breaks.
+    if input_format == 'csv':
+        lines = (row for row in csv.reader(input) if row)
+        fields = next(lines, None)
+        if fields is None:
+            return 0, 0
+    else:
+        # Blank lines are no records, like empty CSV rows
+        lines = (line for line in input if line.strip())
+        first = next(lines, None)
+        if first is None:
+            return 0, 0
+        fields = list(parse_json_record(first, 1))
+        lines = itertools.chain([first], lines)
+    fields += [column for column in get_result_columns(metrics, languages) if column not in fields]
+    if output_format in columnar.FORMATS:
+        writer = columnar.create_writer(output, output_format, metrics, languages)
+    else:
+        writer = TextWriter(output, output_format, fields)
+
+    count = 0
+    invalid = 0
+    args = (fields, input_format, output_format, imperial, metrics, languages)
+    if jobs == 1:
+        for chunk, first_line in read_chunks(lines, chunk_size):
+            scored, records, undefined = score_lines(chunk, *args, first_line)
+            writer.write(scored)
+            count += records
+            invalid += undefined
+        writer.close()
+        return count, invalid
+    # Keeping only a couple of chunks per worker in flight so memory use
+    # stays flat, futures are written out in submission order
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        pending = collections.deque()
+        for chunk, first_line in read_chunks(lines, chunk_size):
+            pending.append(executor.submit(score_lines, chunk, *args, first_line))
+            if len(pending) >= 2 * jobs:
+                scored, records, undefined = pending.popleft().result()
+                writer.write(scored)
+                count += records
+                invalid += undefined
+        while pending:
+            scored, records, undefined = pending.popleft().result()
+            writer.write(scored)
+            count += records
+            invalid += undefined
+    writer.close()
+    return count, invalid
+
+# Comma separated metric names of the --metrics option
+def parse_metrics(text):
+    metrics = [name.strip() for name in text.split(',') if name.strip()]
+    for name in metrics:
+        if name not in engine.REGISTRY:
+            raise argparse.ArgumentTypeError(
+                f"unknown metric '{name}', choose from {', '.join(engine.METRICS)}"
+            )
+    if not metrics:
+        raise argparse.ArgumentTypeError("no metrics given")
+    return metrics
+
+# Comma separated language codes of the --labels option
+def parse_languages(text):
+    return [language.strip() for language in text.split(',') if language.strip()]
+
+# Returns the type of an integer option which has to be at least minimum
+def get_count_type(minimum):
+    def parse_count(text):
+        try:
+            value = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"'{text}' is not a whole number") from None
+        if value < minimum:
+            raise argparse.ArgumentTypeError(f"has to be at least {minimum}, not {value}")
+        return value
+    return parse_count
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog="bmi --batch",
+        description="Score CSV or JSONL measurement records without starting the GUI.",
+    )
+    parser.add_argument('--batch', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('input', nargs='?', default='-',
+                        help="input file, '-' or nothing for stdin")
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file, '-' or nothing for stdout")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="input format, guessed from the file name by default")
+    parser.add_argument('--output-format', choices=['csv', 'jsonl'] + columnar.FORMATS,
+                        help="output format, guessed from the output file name or the "
+                             "same as the input format by default")
+    parser.add_argument('--imperial', action='store_true',
+                        help="inputs are in inches and pounds")
+    parser.add_argument('--metrics', type=parse_metrics, default=engine.METRICS,
+                        help="comma separated metrics to compute, all of them by default")
+    parser.add_argument('--labels', type=parse_languages, default=[], metavar='LANGUAGES',
+                        help="comma separated languages to also write the category labels "
+                             "in, e.g. 'es,fr', one column each")
+    parser.add_argument('--chunk-size', type=get_count_type(1), default=4096,
+                        help="records scored per vectorized pass")
+    parser.add_argument('-j', '--jobs', type=get_count_type(0), default=1,
+                        help="worker processes, 0 for one per CPU core")
+    parser.add_argument('--stats', action='store_true',
+                        help="print the number of records scored per second to stderr")
+    return parser
+
+def main(argv):
+    args = create_parser().parse_args(argv[1:])
+    input_format = args.format or guess_format(args.input)
+    output_format = args.output_format or guess_output_format(args.output, input_format)
+    if output_format in columnar.FORMATS and engine.np is None:
+        print(f"bmi: {output_format} output needs NumPy", file=sys.stderr)
+        return 1
+    try:
+        input = sys.stdin if args.input == '-' else open(args.input, newline='')
+    except OSError as error:
+        print(f"bmi: {error}", file=sys.stderr)
+        return 1
+    try:
+        if output_format in columnar.FORMATS:
+            output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        else:
+            output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    except OSError as error:
+        print(f"bmi: {error}", file=sys.stderr)
+        if input is not sys.stdin: input.close()
+        return 1
+    jobs = args.jobs or os.cpu_count() or 1
+    for language in args.labels:
+        if language not in labels.get_languages():
+            print(f"bmi: no catalog for '{language}', its labels are untranslated", file=sys.stderr)
+    try:
+        start = time.perf_counter()
+        count, invalid = run(input, output, input_format, output_format,
+                             args.imperial, args.chunk_size, jobs, args.metrics, args.labels)
+        elapsed = time.perf_counter() - start
+        if invalid:
+            print(f"bmi: {invalid} of {count} records have no BRI, see 'bri_reason'",
+                  file=sys.stderr)
+        if args.stats:
+            rate = count / elapsed if elapsed else 0
+            print(f"bmi: {count} records in {elapsed:.2f} s "
+                  f"({rate:.0f} records/s, {jobs} jobs)", file=sys.stderr)
+    except ValueError as error:
+        print(f"bmi: {error}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # The reader went away (e.g. 'bmi --batch | head'), not an error
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 0
+    finally:
+        if input is not sys.stdin: input.close()
+        if output not in (sys.stdout, sys.stdout.buffer): output.close()
+    return 0
@@ -0,0 +1,184 @@
+# chart.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Trend chart of the measurement history. The history is reduced to one
+# min/max bucket per pixel by SQLite and drawn into an image on a worker
+# thread, the main thread only paints the last image, moved and stretched to
+# the current view while dragging or zooming until the next one is ready.
+
+# Imports
+from gi.repository import Gtk, GLib
+from concurrent.futures import ThreadPoolExecutor
+import cairo
+from . import history
+
+# Plotted columns as (column, label, colour), one lane each from top to bottom
+series = [
+  ('bmi',  "BMI",            (0.21, 0.52, 0.89)),
+  ('whtr', "Waist / Height", (0.20, 0.82, 0.48)),
+  ('bri',  "BRI",            (1.00, 0.47, 0.00)),
+]
+
+class TrendChart(Gtk.DrawingArea):
+    __gtype_name__ = 'BmiTrendChart'
+    def __init__(self, history_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.history_path = history_path
+        # Rendering happens on a single worker thread, which also owns the
+        # history connection as SQLite connections can't change threads
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.store = None
+        # Shown time range, None until the history was read
+        self.view = None
+        # Last rendered image and the view it shows
+        self.image = None
+        self.image_view = None
+        self.rendering = False
+        self.render_pending = False
+        self.drag_view = None
+        self.zoom_x = None
+
+        self.set_draw_func(self.on_draw)
+        self.connect('resize', self.on_resize)
+        self.connect('destroy', self.on_destroy)
+        # Dragging pans, scrolling zooms around the pointer
+        drag = Gtk.GestureDrag()
+        drag.connect('drag-begin', self.on_drag_begin)
+        drag.connect('drag-update', self.on_drag_update)
+        self.add_controller(drag)
+        scroll = Gtk.EventControllerScroll(flags=Gtk.EventControllerScrollFlags.VERTICAL)
+        scroll.connect('scroll', self.on_scroll)
+        self.add_controller(scroll)
+        motion = Gtk.EventControllerMotion()
+        motion.connect('motion', self.on_motion)
+        self.add_controller(motion)
+
+    # Asks the worker for a new image, while one is being rendered only the
+    # latest request is kept
+    def request_render(self):
+        width, height = self.get_width(), self.get_height()
+        if width <= 0 or height <= 0:
+            return
+        if self.rendering:
+            self.render_pending = True
+            return
+        self.rendering = True
+        future = self.executor.submit(self.render, self.view, width, height)
+        future.add_done_callback(lambda future: GLib.idle_add(self.on_rendered, future))
+
+    def on_rendered(self, future):
+        self.rendering = False
+        image, view = future.result()
+        if image is not None:
+            self.image = image
+            self.image_view = view
+            if self.view is None:
+                self.view = view
+            self.queue_draw()
+        if self.render_pending:
+            self.render_pending = False
+            self.request_render()
+        return GLib.SOURCE_REMOVE
+
+    # Runs on the worker thread, returns (image, view)
+    def render(self, view, width, height):
+        if self.store is None:
+            self.store = history.History(self.history_path)
+        if view is None:
+            first, last = self.store.time_range()
+            if first is None:
+                return None, None
+            view = (first, last + 1)
+        start, end = view
+        image = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        context = cairo.Context(image)
+        context.set_line_width(1)
+        lane_height = height / len(series)
+        for lane, (column, label, colour) in enumerate(series):
+            top = lane * lane_height
+            context.set_source_rgb(*colour)
+            context.move_to(4, top + 12)
+            context.show_text(label)
+            context.new_path()
+            buckets = self.store.buckets(column, start, end, width)
+            if not buckets:
+                continue
+            low = min(bucket[1] for bucket in buckets)
+            high = max(bucket[2] for bucket in buckets)
+            scale = (lane_height - 20) / ((high - low) or 1)
+            def to_y(value):
+                return top + lane_height - 4 - (value - low) * scale
+            # A vertical stroke per pixel from the bucket's minimum to its
+            # maximum, joined to the neighbouring buckets
+            for bucket, minimum, maximum in buckets:
+                x = bucket + 0.5
+                context.line_to(x, to_y(minimum))
+                context.line_to(x, to_y(maximum))
+            context.stroke()
+        return image, view
+
+    def on_draw(self, area, context, width, height):
+        if self.image is None:
+            return
+        # Mapping the image's view onto the current one
+        start, end = self.view
+        image_start, image_end = self.image_view
+        scale = (image_end - image_start) / (end - start)
+        context.translate((image_start - start) / (end - start) * width, 0)
+        context.scale(scale * width / self.image.get_width(), height / self.image.get_height())
+        context.set_source_surface(self.image, 0, 0)
+        context.paint()
+
+    def on_resize(self, area, width, height):
+        self.request_render()
+
+    def on_destroy(self, area):
+        if self.store is not None:
+            self.executor.submit(self.store.close)
+        self.executor.shutdown(wait=False)
+
+    def on_drag_begin(self, gesture, x, y):
+        # Claiming the drag so it doesn't move the window
+        gesture.set_state(Gtk.EventSequenceState.CLAIMED)
+        self.drag_view = self.view
+
+    def on_drag_update(self, gesture, offset_x, offset_y):
+        if self.drag_view is None:
+            return
+        start, end = self.drag_view
+        shift = offset_x / self.get_width() * (end - start)
+        self.view = (start - shift, end - shift)
+        self.queue_draw()
+        self.request_render()
+
+    def on_motion(self, controller, x, y):
+        self.zoom_x = x
+
+    def on_scroll(self, controller, dx, dy):
+        if self.view is None:
+            return False
+        start, end = self.view
+        x = self.zoom_x if self.zoom_x is not None else self.get_width() / 2
+        pivot = start + x / self.get_width() * (end - start)
+        factor = 1.2 ** dy
+        self.view = (pivot - (pivot - start) * factor, pivot + (end - pivot) * factor)
+        self.queue_draw()
+        self.request_render()
+        return True
@@ -0,0 +1,172 @@
+# columnar.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Binary columnar output of the batch mode, which downstream tools can
+# memory-map instead of parsing:
+#
+#   npy    one structured NumPy array, numpy.load(path, mmap_mode='r'). The
+#          metrics are float64 and NaN where they aren't defined, the
+#          '<metric>_category' columns of the metrics with bands hold
+#          indices into engine.BANDS or engine.INVALID, where the value is
+#          NaN, and 'bri_reason' the index into engine.BRI_REASONS.
+#   arrow  an Arrow IPC file, pyarrow.ipc.open_file(pyarrow.memory_map(path)).
+#          Metrics rounded to whole numbers are int32 and null where they
+#          aren't defined. The category and reason columns are
+#          dictionary-encoded with their labels, undefined categories and
+#          defined BRIs are null. Labels in other languages are more
+#          dictionary columns sharing the indices.
+#
+# Both hold the parsed inputs in centimetres and kilograms followed by the
+# results of the requested metrics, one row per input record in input order.
+
+# Imports
+import struct
+from . import engine, labels
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+FORMATS = ['npy', 'arrow']
+EXTENSIONS = {'.npy': 'npy', '.arrow': 'arrow', '.feather': 'arrow'}
+
+def get_dtype(metrics=engine.METRICS):
+    # The inputs in the order of engine.INPUTS, gender last
+    fields = [(name, '<f8') for name in engine.INPUTS[:-1]] + [('gender', 'i1')]
+    for metric in engine.get_plan(metrics).metrics:
+        fields.append((metric.name, '<f8'))
+        if metric.bands:
+            fields.append((f"{metric.name}_category", 'i1'))
+    if 'bri' in metrics:
+        fields.append(('bri_reason', 'i1'))
+    return np.dtype(fields)
+
+# Packs input columns, engine.compute_batch() results and the BRI reason
+# codes, None without BRI, into one structured array
+def create_table(columns, results, bri_reasons):
+    table = np.empty(len(columns[0]), dtype=get_dtype(list(results)))
+    for name, column in zip(engine.INPUTS, columns):
+        table[name] = column
+    for metric, (values, categories) in results.items():
+        table[metric] = values
+        if engine.REGISTRY[metric].bands:
+            table[f"{metric}_category"] = categories
+    if bri_reasons is not None:
+        table['bri_reason'] = bri_reasons
+    return table
+
+# The .npy header is padded to a fixed size so it can be rewritten with the
+# final number of rows once everything was streamed out
+npy_header_size = 1024
+def write_npy_header(stream, dtype, rows):
+    header = repr({
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': (rows,),
+    })
+    header = header.ljust(npy_header_size - 10 - 1) + '\n'
+    stream.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+class NpyWriter:
+    def __init__(self, stream, metrics=engine.METRICS):
+        if not stream.seekable():
+            raise ValueError("npy output has to go to a file")
+        self.stream = stream
+        self.dtype = get_dtype(metrics)
+        self.rows = 0
+        write_npy_header(stream, self.dtype, 0)
+
+    def write(self, table):
+        self.stream.write(table.tobytes())
+        self.rows += len(table)
+
+    def close(self):
+        self.stream.seek(0)
+        write_npy_header(self.stream, self.dtype, self.rows)
+        self.stream.flush()
+
+class ArrowWriter:
+    def __init__(self, stream, metrics=engine.METRICS, languages=()):
+        if pa is None:
+            raise ValueError("arrow output needs pyarrow")
+        self.dictionaries = {
+            f"{metric}_category": pa.array([text for text, style in engine.BANDS[metric]])
+            for metric in metrics if engine.REGISTRY[metric].bands
+        }
+        self.dictionaries['bri_reason'] = pa.array(engine.BRI_REASONS)
+        # Translated columns by the column whose indices they reuse, the
+        # dictionaries leave out the entry of engine.INVALID as that is null
+        self.translations = {}
+        names = list(self.dictionaries)
+        for language in languages:
+            table = labels.get_table(language)
+            for name in names:
+                if name == 'bri_reason':
+                    texts = table.reasons
+                else:
+                    texts = table.get_labels(name[:-len('_category')])[:-1]
+                self.dictionaries[f"{name}_{language}"] = pa.array(texts)
+                self.translations.setdefault(name, []).append(f"{name}_{language}")
+        fields = []
+        for name, dtype in get_dtype(metrics).descr:
+            if name in self.dictionaries:
+                for column in [name] + self.translations.get(name, []):
+                    fields.append(pa.field(column, pa.dictionary(pa.int8(), pa.string())))
+            elif name in engine.REGISTRY and engine.DIGITS[name] == 0:
+                fields.append(pa.field(name, pa.int32()))
+            else:
+                fields.append(pa.field(name, pa.from_numpy_dtype(np.dtype(dtype))))
+        self.schema = pa.schema(fields)
+        self.sources = {
+            column: name for name, columns in self.translations.items() for column in columns
+        }
+        self.writer = pa.ipc.new_file(stream, self.schema)
+
+    def write(self, table):
+        arrays = []
+        for field in self.schema:
+            source = self.sources.get(field.name, field.name)
+            column = table[source]
+            if field.name in self.dictionaries:
+                # Null for INVALID categories and for reasons of valid rows
+                mask = column <= 0 if source == 'bri_reason' else column < 0
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    np.where(mask, 0, column), self.dictionaries[field.name], mask=mask
+                ))
+            elif field.type == pa.int32():
+                mask = np.isnan(column)
+                arrays.append(pa.array(np.where(mask, 0, column).astype(np.int32), mask=mask))
+            else:
+                arrays.append(pa.array(column))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+# The npy indices are the same in any language, so it has no translated
+# columns
+def create_writer(stream, format, metrics=engine.METRICS, languages=()):
+    if format == 'npy':
+        return NpyWriter(stream, metrics)
+    return ArrowWriter(stream, metrics, languages)
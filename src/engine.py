@@ -0,0 +1,501 @@
+# engine.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# The metrics engine. Everything in here works without Gtk/Adw, both for a
+# single set of inputs (used by the window) and for whole NumPy arrays of
+# inputs (used for batch scoring).
+#
+# Metrics are declared once in REGISTRY with their inputs, formula, rounding
+# and bands. A set of metrics is compiled into a Plan, which the window and
+# the batch mode evaluate, so only the requested metrics are computed.
+
+# Imports
+import bisect
+import functools
+import math
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Marks a string for translation without translating it, the caller is
+# expected to pass it through _() when showing it
+def N_(message): return message
+
+# Genders, in the same order as the gender row and the 'gender' setting
+AVERAGE = 0
+FEMALE = 1
+MALE = 2
+
+# Inputs of the metrics, in the order compute() takes them
+INPUTS = ['height', 'mass', 'waist', 'hip', 'age', 'gender']
+
+# Inputs which may be left out, same as the defaults of the settings
+DEFAULTS = {'waist': 70, 'hip': 85, 'age': 30, 'gender': AVERAGE}
+
+# Gender names accepted besides the numbers above
+GENDERS = {'average': AVERAGE, 'female': FEMALE, 'male': MALE}
+def parse_gender(value):
+    if isinstance(value, str) and value.strip().lower() in GENDERS:
+        return GENDERS[value.strip().lower()]
+    gender = int(value)
+    if gender not in GENDERS.values() or gender != float(value):
+        raise ValueError(f"unknown gender '{value}'")
+    return gender
+
+# Band index of values a metric isn't defined for, which are NaN
+INVALID = -1
+INVALID_LABEL = N_('Not defined')
+
+# Why a BRI is INVALID, by the reason codes get_bri_reason() returns
+BRI_VALID = 0
+BRI_WAIST_TOO_LONG = 1
+BRI_BAD_INPUT = 2
+BRI_REASONS = [
+  '',
+  N_('Waist longer than pi times the height'),
+  N_('Height or waist missing or not positive'),
+]
+
+# For easier conversions
+def in_to_cm(value): return value * 2.54
+def cm_to_in(value): return value * 0.3937008
+def kg_to_lb(value): return value * 2.204623
+def lb_to_kg(value): return value * 0.4535924
+
+# Waist to height ratio above which it is unhealthy
+def get_whtr_unhealthy(age):
+    if age > 40: return ((age - 40) / 100) + 0.5
+    else:        return 0.5
+
+# Waist to hip ratio above which it is overweight/obese
+def get_whr_overweight(gender):
+    if gender == FEMALE: return 0.8
+    elif gender == MALE: return 0.9
+    else:                return 0.85
+def get_whr_obese(gender):
+    if gender == FEMALE: return 0.85
+    elif gender == MALE: return 1
+    else:                return 0.925
+
+# Sorted lower bounds of the bands, the first band always starts at 0.
+# Bounds which depend on age or gender are compiled into one table per age
+# bracket or gender.
+BOUNDS = {
+  'basic_bmi': (0, 18.5, 25, 30, 40),
+  'bmi':       (0, 16, 17, 18.5, 25, 30, 35, 40),
+  'bri':       (0, 3.41, 4.45, 5.46, 6.91),
+}
+WHR_BOUNDS = {
+  gender: (0, get_whr_overweight(gender), get_whr_obese(gender))
+  for gender in (AVERAGE, FEMALE, MALE)
+}
+# Every age above 40 is a bracket of its own, up to the oldest age the
+# window accepts
+WHTR_BOUNDS = {
+  age: (0, get_whtr_unhealthy(age)) for age in range(40, 124)
+}
+
+def get_whtr_bounds(bracket):
+    bounds = WHTR_BOUNDS.get(bracket)
+    if bounds is None:
+        bounds = (0, get_whtr_unhealthy(bracket))
+    return bounds
+
+def get_whr_bounds(gender):
+    return WHR_BOUNDS.get(gender, WHR_BOUNDS[AVERAGE])
+
+# Formulas, inputs are in centimetres, kilograms and years. Unless a
+# metric has a batch formula of its own, the same function is used for
+# single values and for NumPy arrays.
+def get_bmi(height, mass):
+    metres = height / 100
+    return mass / (metres * metres)
+
+def get_whtr(height, waist):
+    return waist / height
+
+def get_whr(waist, hip):
+    return waist / hip
+
+# Calculating BRI, '1 - (waist / (pi * height)) ** 2' is negative when the
+# waist is longer than the circumference of a 'height' wide circle, BRI is
+# not defined then and NaN is returned, get_bri_reason() tells why
+def get_bri(height, waist):
+    if not (0 < height < math.inf and 0 <= waist < math.inf):
+        return math.nan
+    ratio = waist / (math.pi * height)
+    radicand = 1 - ratio * ratio
+    if radicand < 0:
+        return math.nan
+    return 364.2 - (365.5 * math.sqrt(radicand))
+
+def get_bri_reason(height, waist):
+    if not (0 < height < math.inf and 0 <= waist < math.inf):
+        return BRI_BAD_INPUT
+    ratio = waist / (math.pi * height)
+    if 1 - ratio * ratio < 0:
+        return BRI_WAIST_TOO_LONG
+    return BRI_VALID
+
+# Vectorized get_bri() and get_bri_reason() in one masked pass over arrays,
+# returns (values with NaN where it is not defined, reason codes as int8)
+def get_bri_batch(height, waist):
+    height = np.asarray(height, dtype=np.float64)
+    waist = np.asarray(waist, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = waist / (math.pi * height)
+        radicand = 1 - ratio * ratio
+    reasons = np.zeros(height.shape, dtype=np.int8)
+    reasons[radicand < 0] = BRI_WAIST_TOO_LONG
+    valid_inputs = (height > 0) & (height < math.inf) & (waist >= 0) & (waist < math.inf)
+    reasons[~valid_inputs] = BRI_BAD_INPUT
+    valid = reasons == BRI_VALID
+    values = np.full(height.shape, np.nan)
+    values[valid] = 364.2 - (365.5 * np.sqrt(radicand[valid]))
+    return values, reasons
+
+# A Body Shape Index, the waist in metres over BMI ** (2/3) times the
+# square root of the height in metres
+def get_absi(height, mass, waist):
+    return (waist / 100) / (get_bmi(height, mass) ** (2 / 3) * math.sqrt(height / 100))
+def get_absi_batch(height, mass, waist):
+    return (waist / 100) / (get_bmi(height, mass) ** (2 / 3) * np.sqrt(height / 100))
+
+# Body surface area in square metres, by Mosteller
+def get_bsa(height, mass):
+    return math.sqrt(height * mass / 3600)
+def get_bsa_batch(height, mass):
+    return np.sqrt(height * mass / 3600)
+
+# Basal metabolic rate in kcal a day, by Mifflin and St Jeor. The average
+# gender takes the middle of the female and male offsets.
+BMR_OFFSETS = {AVERAGE: -78, FEMALE: -161, MALE: 5}
+# A rate which isn't positive, e.g. of a very small and old person, is
+# undefined.
+def get_bmr(height, mass, age, gender):
+    bmr = 10 * mass + 6.25 * height - 5 * age + BMR_OFFSETS.get(gender, BMR_OFFSETS[AVERAGE])
+    return bmr if bmr > 0 else math.nan
+def get_bmr_batch(height, mass, age, gender):
+    offsets = np.where(gender == FEMALE, BMR_OFFSETS[FEMALE], BMR_OFFSETS[AVERAGE])
+    offsets = np.where(gender == MALE, BMR_OFFSETS[MALE], offsets)
+    bmr = 10 * mass + 6.25 * height - 5 * age + offsets
+    return np.where(bmr > 0, bmr, np.nan)
+
+# Ideal weight in kilograms, by Devine, 2.3 kg per inch over 5 feet. The
+# formula is only defined from 5 feet up, below it is undefined.
+IDEAL_WEIGHT_BASES = {AVERAGE: 47.75, FEMALE: 45.5, MALE: 50}
+IDEAL_WEIGHT_MIN_HEIGHT = 152.4
+def get_ideal_weight(height, gender):
+    if not height >= IDEAL_WEIGHT_MIN_HEIGHT:
+        return math.nan
+    return IDEAL_WEIGHT_BASES.get(gender, IDEAL_WEIGHT_BASES[AVERAGE]) + 2.3 * (cm_to_in(height) - 60)
+def get_ideal_weight_batch(height, gender):
+    bases = np.where(gender == FEMALE, IDEAL_WEIGHT_BASES[FEMALE], IDEAL_WEIGHT_BASES[AVERAGE])
+    bases = np.where(gender == MALE, IDEAL_WEIGHT_BASES[MALE], bases)
+    return np.where(height >= IDEAL_WEIGHT_MIN_HEIGHT, bases + 2.3 * (cm_to_in(height) - 60), np.nan)
+
+# Age brackets and genders the WHtR and WHR bounds are looked up by, for
+# single values and for arrays
+def get_whtr_bracket(age, gender):
+    return age if age > 40 else 40
+def get_whtr_brackets(age, gender):
+    return np.where(age > 40, age, 40)
+def get_whr_bracket(age, gender):
+    return gender
+def get_whr_brackets(age, gender):
+    return np.where(np.isin(gender, (FEMALE, MALE)), gender, AVERAGE)
+
+# A metric of the registry:
+#   inputs         names out of INPUTS the formula takes, in that order
+#   digits         decimals the value is rounded to, 0 makes it an integer
+#   bands          (text, style) of the bands, none for metrics which are
+#                  only shown as a value
+#   bounds         sorted lower bounds of the bands, or with bracket a
+#                  function returning them for a bracket
+#   bracket        (function, vectorized function, inputs) where the
+#                  functions of age and gender return the bracket the
+#                  bounds depend on, and inputs are the ones they use
+#   batch_formula  the formula for NumPy arrays, if the scalar one doesn't
+#                  work on them
+#   exact          False if the batch formula can differ from the scalar
+#                  one in the last bit, rows close to a rounding boundary
+#                  are then computed again the scalar way
+#   unit           'kg' for masses, converted in imperial mode, or the
+#                  symbol shown after the value
+class Metric:
+    def __init__(self, name, title, description, inputs, formula, digits, bands=(),
+                 bounds=(), bracket=None, batch_formula=None, exact=True, unit=None):
+        self.name = name
+        self.title = title
+        self.description = description
+        self.inputs = inputs
+        self.formula = formula
+        self.batch_formula = batch_formula or formula
+        self.digits = digits
+        self.bands = bands
+        self.bounds = bounds
+        self.bracket = bracket
+        self.exact = exact
+        self.unit = unit
+        # Inputs the value and band depend on
+        self.dependencies = inputs + (bracket[2] if bracket else ())
+
+    def get_bounds(self, age, gender):
+        if self.bracket is None:
+            return self.bounds
+        return self.bounds(self.bracket[0](age, gender))
+
+    # Index of the band a value falls into. Values below the first bound are
+    # put into the first band, NaN is INVALID.
+    def classify(self, value, age, gender):
+        if value != value:
+            return INVALID
+        return max(bisect.bisect_right(self.get_bounds(age, gender), value) - 1, 0)
+
+    # Vectorized classify() over arrays of values, ages and genders
+    def classify_batch(self, values, age, gender):
+        if self.bracket is None:
+            categories = np.searchsorted(self.bounds, values, side='right')
+        else:
+            keys = self.bracket[1](age, gender)
+            categories = np.empty(len(values), dtype=np.intp)
+            for key in np.unique(keys):
+                rows = keys == key
+                categories[rows] = np.searchsorted(self.bounds(key.item()), values[rows], side='right')
+        categories = np.maximum(categories - 1, 0).astype(np.int8)
+        categories[np.isnan(values)] = INVALID
+        return categories
+
+REGISTRY = {metric.name: metric for metric in [
+  Metric('basic_bmi', N_('BMI'), N_('Body Mass Index'), ('height', 'mass'), get_bmi, 0,
+    bands=[
+      (N_('Underweight'),     'light-blue'),
+      (N_('Healthy'),         'success'),
+      (N_('Overweight'),      'warning'),
+      (N_('Obese'),           'error'),
+      (N_('Extremely obese'), 'error'),
+    ],
+    bounds=BOUNDS['basic_bmi']),
+  Metric('bmi', N_('BMI'), N_('Body Mass Index'), ('height', 'mass'), get_bmi, 1,
+    bands=[
+      (N_('Underweight [Severe]'),   'light-blue'),
+      (N_('Underweight [Moderate]'), 'light-blue'),
+      (N_('Underweight [Mild]'),     'light-blue'),
+      (N_('Healthy'),                'success'),
+      (N_('Overweight'),             'warning'),
+      (N_('Obese [Class 1]'),        'error'),
+      (N_('Obese [Class 2]'),        'error'),
+      (N_('Obese [Class 3]'),        'error'),
+    ],
+    bounds=BOUNDS['bmi']),
+  Metric('whtr', N_('Waist / Height'), N_('Waist to height ratio'), ('height', 'waist'), get_whtr, 2,
+    bands=[
+      (N_('Healthy'),   'success'),
+      (N_('Unhealthy'), 'warning'),
+    ],
+    bounds=get_whtr_bounds, bracket=(get_whtr_bracket, get_whtr_brackets, ('age',))),
+  Metric('whr', N_('Waist / Hip'), N_('Waist to hip ratio'), ('waist', 'hip'), get_whr, 2,
+    bands=[
+      (N_('Healthy'),    'success'),
+      (N_('Overweight'), 'warning'),
+      (N_('Obese'),      'error'),
+    ],
+    bounds=get_whr_bounds, bracket=(get_whr_bracket, get_whr_brackets, ('gender',))),
+  Metric('bri', N_('BRI'), N_('Body Roundness Index'), ('height', 'waist'), get_bri, 2,
+    bands=[
+      (N_('Very lean'),     'light-blue'),
+      (N_('Lean'),          'success'),
+      (N_('Average'),       'success'),
+      (N_('Above average'), 'warning'),
+      (N_('High'),          'error'),
+    ],
+    bounds=BOUNDS['bri'], batch_formula=lambda height, waist: get_bri_batch(height, waist)[0]),
+  Metric('absi', N_('ABSI'), N_('A Body Shape Index'), ('height', 'mass', 'waist'), get_absi, 4,
+    batch_formula=get_absi_batch, exact=False),
+  Metric('bsa', N_('BSA'), N_('Body surface area'), ('height', 'mass'), get_bsa, 2,
+    batch_formula=get_bsa_batch, unit='m²'),
+  Metric('bmr', N_('BMR'), N_('Basal metabolic rate'), ('height', 'mass', 'age', 'gender'), get_bmr, 0,
+    batch_formula=get_bmr_batch, unit='kcal'),
+  Metric('ideal_weight', N_('Ideal weight'), N_('Ideal weight by the Devine formula'), ('height', 'gender'),
+    get_ideal_weight, 1, batch_formula=get_ideal_weight_batch, unit='kg'),
+]}
+
+# Result metrics, in display order, and what the registry says about them
+METRICS = list(REGISTRY)
+DIGITS = {name: metric.digits for name, metric in REGISTRY.items()}
+# Threshold bands of each metric as (text, style), metrics without bands
+# have a single unnamed one
+BANDS = {name: list(metric.bands) or [('', None)] for name, metric in REGISTRY.items()}
+# Inputs each metric depends on, thresholds included
+DEPENDENCIES = {name: metric.dependencies for name, metric in REGISTRY.items()}
+
+# Returns the untranslated label of a band index, INVALID included
+def get_label(metric, category):
+    if category == INVALID:
+        return INVALID_LABEL
+    return BANDS[metric][category][0]
+
+# Returns the bounds of a metric for the given age and gender
+def get_bounds(metric, age, gender):
+    return REGISTRY[metric].get_bounds(age, gender)
+
+def classify(metric, value, age, gender):
+    return REGISTRY[metric].classify(value, age, gender)
+
+def classify_batch(metric, values, age, gender):
+    return REGISTRY[metric].classify_batch(values, age, gender)
+
+# Returns the metrics which have to be recalculated after the given inputs
+# changed, in display order
+def get_dirty(changed):
+    return [metric for metric in METRICS if not changed.isdisjoint(DEPENDENCIES[metric])]
+
+# Rounds like round() does. numpy.round() scales by 10 ** digits first, which
+# can land on the other side of a .5 boundary, so those few values are
+# rounded again one by one.
+def round_array(values, digits):
+    rounded = np.round(values, digits)
+    if digits == 0:
+        return rounded
+    for i in np.flatnonzero(get_close_to_boundary(values, digits)):
+        rounded.flat[i] = round(float(values.flat[i]), digits)
+    return rounded
+
+def get_close_to_boundary(values, digits):
+    scaled = values * 10 ** digits
+    with np.errstate(invalid='ignore'):
+        return np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+
+# The metrics of the registry out of a set of names, compiled into a list
+# of steps. Metrics sharing a formula, like both BMIs, evaluate it once.
+class Plan:
+    def __init__(self, metrics):
+        for name in metrics:
+            if name not in REGISTRY:
+                raise ValueError(f"unknown metric '{name}'")
+        self.metrics = [metric for name, metric in REGISTRY.items() if name in metrics]
+        self.names = [metric.name for metric in self.metrics]
+        # Positions of each metric's inputs in the arguments of compute()
+        self.steps = [
+            (metric, [INPUTS.index(name) for name in metric.inputs]) for metric in self.metrics
+        ]
+
+    # Returns {metric: (rounded value, band index)} for one set of inputs in
+    # centimetres and kilograms
+    def compute(self, height, mass, waist, hip, age, gender):
+        inputs = (height, mass, waist, hip, age, gender)
+        values = {}
+        results = {}
+        for metric, positions in self.steps:
+            value = values.get(metric.formula)
+            if value is None:
+                value = values[metric.formula] = metric.formula(*[inputs[i] for i in positions])
+            value = round(value, metric.digits)
+            # Whole numbers can't be infinite, those are undefined like NaN
+            if metric.digits == 0:
+                value = int(value) if math.isfinite(value) else math.nan
+            results[metric.name] = (value, metric.classify(value, age, gender))
+        return results
+
+    # Vectorized compute() over arrays of inputs, returns
+    # {metric: (rounded values, band indices)} with one entry per row
+    def compute_batch(self, height, mass, waist, hip, age, gender):
+        if np is None:
+            raise RuntimeError("NumPy is required for batch computation")
+        inputs = [np.asarray(column, dtype=np.float64) for column in (height, mass, waist, hip, age)]
+        inputs.append(np.asarray(gender, dtype=np.int64))
+        age, gender = inputs[4], inputs[5]
+        values = {}
+        results = {}
+        for metric, positions in self.steps:
+            value = values.get(metric.formula)
+            if value is None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = metric.batch_formula(*[inputs[i] for i in positions])
+                values[metric.formula] = value
+            rounded = round_array(value, metric.digits)
+            if not metric.exact:
+                for i in np.flatnonzero(get_close_to_boundary(value, metric.digits)):
+                    scalar = metric.formula(*[inputs[position][i].item() for position in positions])
+                    rounded[i] = round(scalar, metric.digits)
+            # Whole numbers are integers unless a row is undefined, then the
+            # values stay floats so it can be NaN
+            if metric.digits == 0:
+                finite = np.isfinite(rounded)
+                if finite.all():
+                    rounded = rounded.astype(np.int64)
+                else:
+                    rounded[~finite] = np.nan
+            results[metric.name] = (rounded, metric.classify_batch(rounded, age, gender))
+        return results
+
+@functools.lru_cache(maxsize=None)
+def compile_plan(metrics):
+    return Plan(metrics)
+
+def get_plan(metrics=METRICS):
+    return compile_plan(tuple(metrics))
+
+# Calculates the given metrics for one set of inputs given in centimetres and
+# kilograms, returns {metric: (rounded value, band index)}. A metric which
+# isn't defined for the inputs is (NaN, INVALID).
+def compute(height, mass, waist, hip, age, gender, metrics=METRICS):
+    return get_plan(metrics).compute(height, mass, waist, hip, age, gender)
+
+# Decimals the centimetres and kilograms are rounded to for the cache, fine
+# enough to leave inputs of 0.1 cm, kg, in or lb apart and coarse enough
+# that a value converted to inches or pounds and back is the same again
+CACHE_DIGITS = 3
+
+# Results of compute(), kept in an LRU cache as the same inputs come up
+# again and again, see cache_info() for its hits and misses. Inputs in
+# inches and pounds are converted first, so both units share the entries.
+# Each metric is cached by the inputs it depends on, so a metric whose
+# inputs didn't change is a hit whatever else did.
+def compute_cached(height, mass, waist, hip, age, gender, imperial=False, metrics=METRICS):
+    if imperial:
+        height, mass, waist, hip = in_to_cm(height), lb_to_kg(mass), in_to_cm(waist), in_to_cm(hip)
+    inputs = {
+        'height': round(height, CACHE_DIGITS), 'mass': round(mass, CACHE_DIGITS),
+        'waist': round(waist, CACHE_DIGITS), 'hip': round(hip, CACHE_DIGITS),
+        'age': round(age), 'gender': int(gender),
+    }
+    return {
+        name: compute_metric(name, *[inputs[input] for input in DEPENDENCIES[name]])
+        for name in get_plan(metrics).names
+    }
+
+# Returns (rounded value, band index) of a metric for the values of its
+# dependencies, the inputs it doesn't depend on are left NaN
+@functools.lru_cache(maxsize=4096)
+def compute_metric(name, *values):
+    inputs = dict.fromkeys(INPUTS, math.nan)
+    inputs.update(zip(DEPENDENCIES[name], values))
+    return compile_plan((name,)).compute(*[inputs[input] for input in INPUTS])[name]
+
+def cache_info():
+    return compute_metric.cache_info()
+
+# Vectorized compute() over arrays of inputs, returns
+# {metric: (rounded values, band indices)} with one entry per row. Like in
+# compute(), rows a metric isn't defined for are NaN and INVALID.
+def compute_batch(height, mass, waist, hip, age, gender, metrics=METRICS):
+    return get_plan(metrics).compute_batch(height, mass, waist, hip, age, gender)
@@ -0,0 +1,113 @@
+# heatmap.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# What-if heatmap of a metric's bands over a grid of heights and weights.
+# The grid is computed in one engine.compute_batch() call and uploaded as a
+# texture, which is kept until an input the metric depends on, other than
+# height and weight, changes. Moving the inputs only moves the marker.
+
+# Imports
+from gi.repository import Gtk, Gdk, GLib
+from . import engine
+
+# Samples per axis
+size = 128
+# Shown ranges in centimetres and kilograms
+height_range = (140, 210)
+mass_range = (40, 140)
+# Colours of the band styles, the same as the result labels use
+style_colours = {
+  'light-blue': (0x62, 0xa0, 0xea),
+  'success':    (0x2e, 0xc2, 0x7e),
+  'warning':    (0xe5, 0xa5, 0x0a),
+  'error':      (0xe0, 0x1b, 0x24),
+}
+# Colour where the metric isn't defined
+invalid_colour = (0x9a, 0x99, 0x96)
+
+# Returns the band indices of a metric over the grid, rows from the tallest
+# height down and columns from the lowest weight up
+def get_grid(metric, waist, hip, age, gender):
+    np = engine.np
+    heights = np.linspace(height_range[1], height_range[0], size)
+    masses = np.linspace(mass_range[0], mass_range[1], size)
+    height, mass = np.meshgrid(heights, masses, indexing='ij')
+    rows = height.size
+    results = engine.compute_batch(
+        height.ravel(), mass.ravel(),
+        np.full(rows, waist), np.full(rows, hip), np.full(rows, age), np.full(rows, gender),
+        metrics=[metric],
+    )
+    return results[metric][1].reshape(size, size)
+
+def create_texture(metric, categories):
+    np = engine.np
+    # engine.INVALID is -1, so it picks the colour appended last
+    palette = np.array(
+        [style_colours[style] for text, style in engine.BANDS[metric]] + [invalid_colour],
+        dtype=np.uint8,
+    )
+    pixels = palette[categories]
+    return Gdk.MemoryTexture.new(
+        size, size, Gdk.MemoryFormat.R8G8B8, GLib.Bytes.new(pixels.tobytes()), size * 3
+    )
+
+class Heatmap(Gtk.Overlay):
+    __gtype_name__ = 'BmiHeatmap'
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.picture = Gtk.Picture(can_shrink=True, content_fit=Gtk.ContentFit.FILL)
+        self.set_child(self.picture)
+        self.marker = Gtk.DrawingArea(can_target=False)
+        self.marker.set_draw_func(self.on_draw_marker)
+        self.add_overlay(self.marker)
+        self.add_css_class("card")
+        self.set_overflow(Gtk.Overflow.HIDDEN)
+        # What the texture was made for and where the current input is, as
+        # fractions of the width and height
+        self.key = None
+        self.position = None
+
+    # Called with the inputs in centimetres and kilograms whenever they change
+    def update(self, metric, inputs):
+        key = (metric,) + tuple(
+            inputs[name] for name in engine.DEPENDENCIES[metric] if name not in ('height', 'mass')
+        )
+        if key != self.key:
+            self.key = key
+            categories = get_grid(
+                metric, inputs['waist'], inputs['hip'], inputs['age'], inputs['gender']
+            )
+            self.picture.set_paintable(create_texture(metric, categories))
+        x = (inputs['mass'] - mass_range[0]) / (mass_range[1] - mass_range[0])
+        y = (height_range[1] - inputs['height']) / (height_range[1] - height_range[0])
+        position = (min(max(x, 0), 1), min(max(y, 0), 1))
+        if position != self.position:
+            self.position = position
+            self.marker.queue_draw()
+
+    def on_draw_marker(self, area, context, width, height):
+        if self.position is None:
+            return
+        x, y = self.position
+        context.set_source_rgb(1, 1, 1)
+        context.set_line_width(2)
+        context.arc(x * width, y * height, 5, 0, 6.2832)
+        context.stroke()
@@ -0,0 +1,124 @@
+# history.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Append-only history of measurements, kept in an SQLite database indexed by
+# time. Queries return cursors or aggregate in SQL, so memory use does not
+# depend on how many entries there are.
+
+# Imports
+import os
+import sqlite3
+import time
+
+# Columns of an entry besides its time, inputs are in centimetres, kilograms
+# and years
+COLUMNS = ['height', 'mass', 'waist', 'hip', 'age', 'gender', 'bmi', 'whtr', 'whr', 'bri']
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS measurements (
+  time INTEGER NOT NULL,
+  {', '.join(f'{column} REAL' for column in COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS measurements_time ON measurements (time);
+"""
+
+def get_default_path():
+    data_dir = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(data_dir, 'bmi', 'history.sqlite')
+
+class History:
+    def __init__(self, path=None):
+        self.path = path or get_default_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    # Appends entries given as dicts with the keys in COLUMNS and optionally
+    # 'time' (seconds since the epoch, now by default), all in one transaction
+    def append(self, entries):
+        now = int(time.time())
+        rows = [
+            [int(entry.get('time', now))] + [entry.get(column) for column in COLUMNS]
+            for entry in entries
+        ]
+        placeholders = ', '.join('?' * (len(COLUMNS) + 1))
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO measurements (time, {', '.join(COLUMNS)}) VALUES ({placeholders})",
+                rows,
+            )
+
+    # Yields (time, *COLUMNS) tuples with start <= time < end, oldest first
+    def range(self, start=0, end=2 ** 62, columns=COLUMNS):
+        for column in columns:
+            if column not in COLUMNS:
+                raise ValueError(f"unknown column '{column}'")
+        yield from self.connection.execute(
+            f"SELECT time, {', '.join(columns)} FROM measurements "
+            "WHERE time >= ? AND time < ? ORDER BY time",
+            (start, end),
+        )
+
+    def count(self, start=0, end=2 ** 62):
+        return self.connection.execute(
+            "SELECT count(*) FROM measurements WHERE time >= ? AND time < ?", (start, end)
+        ).fetchone()[0]
+
+    def last(self):
+        return self.connection.execute(
+            f"SELECT time, {', '.join(COLUMNS)} FROM measurements ORDER BY time DESC LIMIT 1"
+        ).fetchone()
+
+    # Returns (oldest time, newest time), or (None, None) if empty
+    def time_range(self):
+        return self.connection.execute("SELECT min(time), max(time) FROM measurements").fetchone()
+
+    # Splits start <= time < end into count equally long buckets and returns
+    # [(bucket, min, max)] of a column for the buckets which have entries,
+    # used to draw charts of long histories one bucket per pixel
+    def buckets(self, column, start, end, count):
+        if column not in COLUMNS:
+            raise ValueError(f"unknown column '{column}'")
+        start, end = int(start), int(end)
+        return self.connection.execute(
+            f"SELECT (time - ?) * ? / ? AS bucket, min({column}), max({column}) "
+            f"FROM measurements WHERE time >= ? AND time < ? AND {column} IS NOT NULL "
+            "GROUP BY bucket ORDER BY bucket",
+            (start, int(count), max(end - start, 1), start, end),
+        ).fetchall()
+
+    # Returns [(month as 'YYYY-MM', min, max, mean, entries)] of a column per
+    # month in local time
+    def monthly(self, column='bmi', start=0, end=2 ** 62):
+        if column not in COLUMNS:
+            raise ValueError(f"unknown column '{column}'")
+        return self.connection.execute(
+            f"SELECT strftime('%Y-%m', time, 'unixepoch', 'localtime') AS month, "
+            f"min({column}), max({column}), avg({column}), count({column}) "
+            "FROM measurements WHERE time >= ? AND time < ? "
+            "GROUP BY month ORDER BY month",
+            (start, end),
+        ).fetchall()
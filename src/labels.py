@@ -0,0 +1,106 @@
+# labels.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Translated label tables, built once per language from the catalogs the
+# po/ directory is compiled into and cached, so showing a result is a list
+# lookup instead of a gettext call. Any number of languages can be used side
+# by side, e.g. by the window after switching the language at runtime or by
+# the batch mode writing the categories in several languages. Nothing in
+# here may import Gtk/Adw.
+
+# Imports
+import functools
+import gettext
+import os
+from . import engine
+
+domain = 'bmi'
+
+# Languages the untranslated messages are in
+source_language = 'en'
+
+# Names of the languages in themselves, the others are shown by their code
+language_names = {
+    'en': "English",
+    'es': "Español",
+    'fr': "Français",
+    'ru': "Русский",
+    'uk': "Українська",
+}
+
+# The directory bmi.in bound the domain to, or the system's one
+def get_localedir():
+    return gettext.bindtextdomain(domain)
+
+# Returns the catalog of a language, None for the one of the environment.
+# Messages without a translation are returned as they are.
+@functools.lru_cache(maxsize=None)
+def get_translation(language=None):
+    languages = None if language is None else [language]
+    return gettext.translation(domain, get_localedir(), languages, fallback=True)
+
+# Returns the languages there is a catalog for, and English
+def get_languages():
+    languages = {source_language}
+    localedir = get_localedir()
+    if localedir and os.path.isdir(localedir):
+        for language in os.listdir(localedir):
+            if os.path.exists(os.path.join(localedir, language, 'LC_MESSAGES', f'{domain}.mo')):
+                languages.add(language)
+    return sorted(languages)
+
+def get_language_name(language):
+    return language_names.get(language, language)
+
+class LabelTable:
+    def __init__(self, language=None):
+        self.language = language
+        self.gettext = get_translation(language).gettext
+        # Empty band texts of the metrics without bands stay empty, the
+        # catalog header is stored under ''
+        translate = lambda text: self.gettext(text) if text else text
+        # Bands by metric and band index, the last entry is for
+        # engine.INVALID, which is -1
+        self.bands = {
+            metric: [(translate(text), style) for text, style in bands]
+                    + [(translate(engine.INVALID_LABEL), 'dim-label')]
+            for metric, bands in engine.BANDS.items()
+        }
+        self.titles = {name: translate(metric.title) for name, metric in engine.REGISTRY.items()}
+        self.descriptions = {name: translate(metric.description) for name, metric in engine.REGISTRY.items()}
+        self.reasons = [translate(reason) for reason in engine.BRI_REASONS]
+
+    def get_label(self, metric, category):
+        return self.bands[metric][category][0]
+
+    # Band labels of a metric by band index, engine.INVALID included
+    def get_labels(self, metric):
+        return [text for text, style in self.bands[metric]]
+
+# Returns the cached table of a language, None for the one of the
+# environment
+@functools.lru_cache(maxsize=None)
+def get_table(language=None):
+    return LabelTable(language)
+
+# Forgets the tables and catalogs, after the catalogs changed on disk
+def clear_cache():
+    get_table.cache_clear()
+    get_translation.cache_clear()
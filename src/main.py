@@ -19,26 +19,142 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import sys
+import json
+import signal
 import gi
 gi.require_version('Gdk', '4.0')
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
-from gi.repository import Gtk, Adw, Gio, Gdk
+from gi.repository import Gtk, Adw, Gio, Gdk, GLib
 
-from .window import BmiWindow
+from . import batch, engine, labels, profiling
+from .service import CalculatorService
+
+# Command line options computing results without opening the window, as
+# (name, argument type, description, argument description)
+options = [
+    ('height',   GLib.OptionArg.DOUBLE, "Height in centimetres", "CM"),
+    ('weight',   GLib.OptionArg.DOUBLE, "Weight in kilograms", "KG"),
+    ('waist',    GLib.OptionArg.DOUBLE, "Waist circumference in centimetres", "CM"),
+    ('hip',      GLib.OptionArg.DOUBLE, "Hip circumference in centimetres", "CM"),
+    ('age',      GLib.OptionArg.DOUBLE, "Age in years", "YEARS"),
+    ('gender',   GLib.OptionArg.STRING, "average, female or male", "GENDER"),
+    ('imperial', GLib.OptionArg.NONE,   "Take inches and pounds instead", None),
+    ('json',     GLib.OptionArg.NONE,   "Print the results as JSON", None),
+    ('profile',  GLib.OptionArg.NONE,   "Time the window's handlers and print a summary on quit", None),
+]
 
 class BmiApplication(Adw.Application):
     """The main application singleton class."""
 
     def __init__(self):
         super().__init__(application_id='io.github.philippkosarev.bmi',
-                         flags=Gio.ApplicationFlags.DEFAULT_FLAGS)
+                         flags=Gio.ApplicationFlags.HANDLES_COMMAND_LINE)
         self.create_action('quit', self.on_quit, ['<primary>q'])
+        for name, arg, description, arg_description in options:
+            self.add_main_option(name, 0, GLib.OptionFlags.NONE, arg, description, arg_description)
+        # Keeping a D-Bus activated instance around for a while after use
+        self.set_inactivity_timeout(60000)
+        self.calculator = CalculatorService(self)
+        self.win = None
+        # Quitting on SIGTERM and SIGHUP the same way as on Ctrl+Q, so the
+        # window's state isn't lost when the session ends
+        for number in (signal.SIGTERM, signal.SIGHUP):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, number, self.on_signal)
+
+    def do_dbus_register(self, connection, object_path):
+        Adw.Application.do_dbus_register(self, connection, object_path)
+        self.calculator.register(connection, object_path)
+        return True
+
+    def do_dbus_unregister(self, connection, object_path):
+        self.calculator.unregister(connection)
+        Adw.Application.do_dbus_unregister(self, connection, object_path)
     
+    # Closing the window like its close button does, which saves its state
     def on_quit(self, action, param):
-        self.win.on_close_window(widget="")
+        if self.win is not None:
+            self.win.close()
         self.quit()
     
+    def on_signal(self):
+        self.activate_action('quit', None)
+        return GLib.SOURCE_CONTINUE
+
+    def do_command_line(self, command_line):
+        """Called with the command line of this or a remote instance.
+
+        Given --height and --weight, the results are printed by the
+        calling process and no window is created. If an instance is
+        already running it handles the command line of the new one.
+        """
+        options = command_line.get_options_dict().end().unpack()
+        if options.get('profile'):
+            profiling.enable()
+        if profiling.enabled and self.lookup_action('profile-summary') is None:
+            self.setup_profiling()
+        if 'height' not in options and 'weight' not in options:
+            self.activate()
+            return 0
+        try:
+            command_line.print_literal(self.get_command_line_results(options))
+        except ValueError as error:
+            command_line.printerr_literal(f"bmi: {error}\n")
+            return 1
+        return 0
+
+    def get_command_line_results(self, options):
+        if 'height' not in options or 'weight' not in options:
+            raise ValueError("--height and --weight are both required")
+        # Parsed like a batch mode record, so the inputs are checked and only
+        # the given ones are converted from imperial units
+        record = {name: options.get(name) for name in ('height', 'waist', 'hip', 'age', 'gender')}
+        record['mass'] = options['weight']
+        try:
+            height, mass, waist, hip, age, gender = batch.parse_record(record, options.get('imperial'))
+        except OverflowError as error:
+            raise ValueError(str(error)) from None
+        results = engine.compute(height, mass, waist, hip, age, gender)
+        # Masses are given back in pounds like they were put in
+        for metric, (value, category) in results.items():
+            if options.get('imperial') and engine.REGISTRY[metric].unit == 'kg':
+                results[metric] = (round(engine.kg_to_lb(value), engine.DIGITS[metric]), category)
+        # Undefined values are left out, with the reason for BRI. Metrics
+        # without bands have no category.
+        reason_code = engine.get_bri_reason(height, waist)
+        reason = engine.BRI_REASONS[reason_code]
+        if options.get('json'):
+            output = {}
+            for metric, (value, category) in results.items():
+                label = engine.get_label(metric, category) if engine.REGISTRY[metric].bands else None
+                output[metric] = {'value': value, 'category': label}
+                if category == engine.INVALID:
+                    output[metric]['value'] = None
+                    output[metric]['category'] = engine.INVALID_LABEL
+                    if metric == 'bri':
+                        output[metric]['reason'] = reason
+            return json.dumps(output) + "\n"
+        lines = []
+        table = labels.get_table()
+        for metric, (value, category) in results.items():
+            label = table.get_label(metric, category)
+            if category == engine.INVALID:
+                value = "-"
+                if metric == 'bri':
+                    label = f"{label}, {table.reasons[reason_code]}"
+            unit = engine.REGISTRY[metric].unit
+            if unit == 'kg' and options.get('imperial'):
+                unit = 'lb'
+            if unit and category != engine.INVALID:
+                value = f"{value} {unit}"
+            lines.append(f"{metric}: {value} ({label})\n" if label else f"{metric}: {value}\n")
+        return "".join(lines)
+
+    # Printing the profile on quit and on Ctrl+Shift+P
+    def setup_profiling(self):
+        self.create_action('profile-summary', lambda *args: profiling.dump(), ['<primary><shift>p'])
+        self.connect('shutdown', lambda app: profiling.dump())
+
     def do_activate(self):
         """Called when the application is activated.
 
@@ -47,6 +163,8 @@ class BmiApplication(Adw.Application):
         """
         self.win = self.props.active_window
         if not self.win:
+            # Imported here so nothing of the window is loaded before it is needed
+            from .window import BmiWindow
             self.win = BmiWindow(application=self)
         self.win.present()
 
@@ -0,0 +1,119 @@
+# profiling.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Optional instrumentation of the window's handlers, enabled with the
+# BMI_PROFILE environment variable or the --profile option. Handlers are
+# wrapped when their module is imported and only if profiling is enabled by
+# then, otherwise the decorator returns them untouched so there is nothing
+# left to pay for. The window module is imported lazily on activation, after
+# the command line was handled.
+
+# Imports
+import os
+import sys
+import time
+import functools
+
+enabled = bool(os.environ.get('BMI_PROFILE'))
+
+# Upper bounds of the latency histogram buckets in milliseconds
+bucket_bounds = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, float('inf')]
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0
+        self.slowest = 0
+        self.writes = 0
+        self.histogram = [0] * len(bucket_bounds)
+
+    def add(self, duration, writes):
+        self.calls += 1
+        self.total += duration
+        self.slowest = max(self.slowest, duration)
+        self.writes += writes
+        milliseconds = duration * 1000
+        for index, bound in enumerate(bucket_bounds):
+            if milliseconds <= bound:
+                self.histogram[index] += 1
+                break
+
+# Stats per handler name and the number of property notifications of the
+# watched widgets so far
+stats = {}
+property_writes = 0
+
+def enable():
+    global enabled
+    enabled = True
+
+# Decorator recording the calls, latency and property writes of a handler,
+# named after the function unless a name is given
+def timed(name=None):
+    def decorator(function):
+        if not enabled:
+            return function
+        handler_stats = stats.setdefault(name or function.__qualname__, HandlerStats())
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            writes = property_writes
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                handler_stats.add(time.perf_counter() - start, property_writes - writes)
+        return wrapper
+    return decorator
+
+# Counts the property writes of widgets, as GObject 'notify' emissions
+def watch(*widgets):
+    if not enabled:
+        return
+    for widget in widgets:
+        widget.connect('notify', on_notify)
+
+def on_notify(_widget, _pspec):
+    global property_writes
+    property_writes += 1
+
+def get_summary():
+    header = f"{'handler':<32} {'calls':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'writes/call':>12}"
+    lines = [header]
+    for name, handler_stats in stats.items():
+        if handler_stats.calls == 0:
+            continue
+        calls = handler_stats.calls
+        lines.append(
+            f"{name:<32} {calls:>7} {handler_stats.total * 1000:>10.2f} "
+            f"{handler_stats.total * 1000 / calls:>9.3f} {handler_stats.slowest * 1000:>9.3f} "
+            f"{handler_stats.writes / calls:>12.1f}"
+        )
+    lines.append("")
+    bounds = ["≤" + format(bound, 'g') if bound != float('inf') else ">100" for bound in bucket_bounds]
+    lines.append(f"{'latency histogram, ms':<32} " + " ".join(f"{bound:>6}" for bound in bounds))
+    for name, handler_stats in stats.items():
+        if handler_stats.calls == 0:
+            continue
+        lines.append(f"{name:<32} " + " ".join(f"{count:>6}" for count in handler_stats.histogram))
+    lines.append(f"\n{property_writes} property writes in total")
+    return "\n".join(lines) + "\n"
+
+def dump(stream=None):
+    (stream or sys.stderr).write(get_summary())
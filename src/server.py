@@ -0,0 +1,274 @@
+# server.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Local HTTP scoring endpoint, started with 'bmi --serve'. Concurrent
+# requests are queued and scored together in one engine.compute_batch()
+# call, a micro-batch is scored once it holds --max-batch rows or its first
+# request waited --max-wait milliseconds. Nothing in here may import Gtk/Adw.
+#
+#   POST /compute  a JSON record like a line of the batch mode's JSONL input,
+#                  or a list of them, answered with the result columns of
+#                  the batch mode for each
+#   GET  /stats    requests, batches and the p50/p99 latency in milliseconds
+#
+#   curl -d '{"height": 180, "mass": 75}' http://127.0.0.1:8080/compute
+
+# Imports
+import argparse
+import asyncio
+import collections
+import json
+import math
+import signal
+import sys
+import time
+from . import batch, engine
+
+# Largest accepted request body, in bytes
+max_body = 1024 * 1024
+
+# Latencies kept for the percentiles, the oldest are dropped
+latency_window = 100000
+
+reasons = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+# Returns the value below which the given share of the sorted samples lie
+def get_percentile(samples, share):
+    if not samples:
+        return None
+    return samples[min(int(share * len(samples)), len(samples) - 1)]
+
+class ServerStats:
+    def __init__(self):
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    def get_summary(self):
+        latencies = sorted(self.latencies)
+        milliseconds = lambda value: None if value is None else round(value * 1000, 3)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'rows': self.rows,
+            'batches': self.batches,
+            'mean_batch_rows': round(self.rows / self.batches, 1) if self.batches else None,
+            'p50_ms': milliseconds(get_percentile(latencies, 0.5)),
+            'p99_ms': milliseconds(get_percentile(latencies, 0.99)),
+        }
+
+# Queues the rows of concurrent requests and scores them together
+class Batcher:
+    def __init__(self, stats, metrics=engine.METRICS, max_batch=256, max_wait=0.002):
+        self.stats = stats
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self.rows = 0
+        self.timer = None
+
+    # Returns the result columns of each row, rows are lists of input values
+    # in centimetres and kilograms
+    async def compute(self, rows):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((rows, future))
+        self.rows += len(rows)
+        if self.rows >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending, self.rows = self.pending, [], 0
+        if not pending:
+            return
+        rows = [row for request_rows, future in pending for row in request_rows]
+        columns = [list(column) for column in zip(*rows)]
+        records = [{} for row in rows]
+        try:
+            batch.add_results(records, columns, engine.compute_batch(*columns, metrics=self.metrics))
+        except Exception as error:
+            # Every request of the batch gets the error instead of waiting
+            # forever
+            for request_rows, future in pending:
+                if not future.cancelled():
+                    future.set_exception(error)
+            return
+        # JSON has no infinity, which extreme inputs can still result in
+        for record in records:
+            for column, value in record.items():
+                if isinstance(value, float) and not math.isfinite(value):
+                    record[column] = None
+        self.stats.batches += 1
+        self.stats.rows += len(rows)
+        first = 0
+        for request_rows, future in pending:
+            if not future.cancelled():
+                future.set_result(records[first:first + len(request_rows)])
+            first += len(request_rows)
+
+class Server:
+    def __init__(self, metrics=engine.METRICS, max_batch=256, max_wait=0.002, imperial=False):
+        self.stats = ServerStats()
+        self.batcher = Batcher(self.stats, metrics, max_batch, max_wait)
+        self.imperial = imperial
+
+    # Returns (status, JSON response) of a request
+    async def dispatch(self, method, path, body):
+        if path == '/stats':
+            if method != 'GET':
+                return 405, {'error': "use GET"}
+            return 200, self.stats.get_summary()
+        if path != '/compute':
+            return 404, {'error': f"no such path '{path}'"}
+        if method != 'POST':
+            return 405, {'error': "use POST"}
+        try:
+            records = json.loads(body)
+            many = isinstance(records, list)
+            if not many:
+                records = [records]
+            if not records or not all(isinstance(record, dict) for record in records):
+                raise ValueError("expected a record or a list of records")
+            rows = batch.parse_columns(records, self.imperial)
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        try:
+            results = await self.batcher.compute([list(row) for row in zip(*rows)])
+        except Exception as error:
+            return 500, {'error': f"could not score the records: {error}"}
+        return 200, results if many else results[0]
+
+    # Serves the requests of one connection, kept open for HTTP/1.1 unless
+    # the client closes it
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                # readline() raises ValueError for lines over the stream's
+                # limit
+                try:
+                    request_line = await reader.readline()
+                    if not request_line.strip():
+                        break
+                    start = time.perf_counter()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if not line.strip():
+                            break
+                        name, _separator, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    method, target, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError("negative Content-Length")
+                except ValueError:
+                    await self.respond(writer, 400, {'error': "malformed request"}, False)
+                    break
+                if length > max_body:
+                    await self.respond(writer, 413, {'error': f"bodies are limited to {max_body} bytes"}, False)
+                    break
+                body = await reader.readexactly(length)
+                status, payload = await self.dispatch(method, target.split('?')[0], body)
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                await self.respond(writer, status, payload, keep_alive)
+                if target.startswith('/compute'):
+                    self.stats.requests += 1
+                    self.stats.errors += status != 200
+                    self.stats.latencies.append(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    # Serves until stop is set, calls ready with the bound port first
+    async def serve(self, host, port, stop, ready=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            await stop.wait()
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog="bmi --serve",
+        description="Score JSON measurement records over HTTP on this host, concurrent "
+                    "requests are scored together in micro-batches.",
+    )
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on, only this host by default")
+    parser.add_argument('--port', type=int, default=8080,
+                        help="port to listen on, 0 for any free one")
+    parser.add_argument('--max-batch', type=int, default=256,
+                        help="rows scored together at most")
+    parser.add_argument('--max-wait', type=float, default=2,
+                        help="milliseconds a request waits for others to join its batch")
+    parser.add_argument('--metrics', type=batch.parse_metrics, default=engine.METRICS,
+                        help="comma separated metrics to compute, all of them by default")
+    parser.add_argument('--imperial', action='store_true',
+                        help="inputs are in inches and pounds")
+    return parser
+
+def main(argv):
+    args = create_parser().parse_args(argv[1:])
+    if engine.np is None:
+        print("bmi: --serve needs NumPy", file=sys.stderr)
+        return 1
+    server = Server(args.metrics, max(args.max_batch, 1), args.max_wait / 1000, args.imperial)
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(number, stop.set)
+        ready = lambda port: print(f"bmi: serving on http://{args.host}:{port}", file=sys.stderr)
+        await server.serve(args.host, args.port, stop, ready)
+    try:
+        asyncio.run(run())
+    except OSError as error:
+        print(f"bmi: {error}", file=sys.stderr)
+        return 1
+    summary = server.stats.get_summary()
+    print(f"bmi: {summary['requests']} requests in {summary['batches']} batches, "
+          f"p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms", file=sys.stderr)
+    return 0
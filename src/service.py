@@ -0,0 +1,117 @@
+# service.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# D-Bus interface exported next to the application's own object, so local
+# services can compute whole arrays of measurements in one call, e.g.
+#
+#   gdbus call --session --dest io.github.philippkosarev.bmi \
+#     --object-path /io/github/philippkosarev/bmi \
+#     --method io.github.philippkosarev.bmi.Calculator.Compute \
+#     "[180.0]" "[75.0]" "[80.0]" "[95.0]" "[30.0]" "[2]"
+
+# Imports
+from gi.repository import Gio, GLib
+from . import engine
+
+interface_name = "io.github.philippkosarev.bmi.Calculator"
+interface_xml = f"""
+<node>
+  <interface name="{interface_name}">
+    <!-- Inputs are in centimetres, kilograms and years, genders are
+         0 (average), 1 (female) or 2 (male). Returns the rounded value and
+         the band index of every metric for every row, a metric which isn't
+         defined for a row is NaN with band index 255. -->
+    <method name="Compute">
+      <arg direction="in" name="height" type="ad"/>
+      <arg direction="in" name="mass" type="ad"/>
+      <arg direction="in" name="waist" type="ad"/>
+      <arg direction="in" name="hip" type="ad"/>
+      <arg direction="in" name="age" type="ad"/>
+      <arg direction="in" name="gender" type="ai"/>
+      <arg direction="out" name="values" type="a{{sad}}"/>
+      <arg direction="out" name="categories" type="a{{say}}"/>
+    </method>
+    <!-- Untranslated labels of the band indices returned by Compute, empty
+         for metrics without bands, whose band index is always 0 -->
+    <method name="GetBands">
+      <arg direction="out" name="bands" type="a{{sas}}"/>
+    </method>
+  </interface>
+</node>
+"""
+
+class CalculatorService:
+    def __init__(self, application):
+        self.application = application
+        self.interface_info = Gio.DBusNodeInfo.new_for_xml(interface_xml).interfaces[0]
+        self.registrations = {}
+
+    def register(self, connection, object_path):
+        self.registrations[connection] = connection.register_object(
+            object_path, self.interface_info, self.on_method_call, None, None
+        )
+
+    def unregister(self, connection):
+        registration = self.registrations.pop(connection, None)
+        if registration is not None:
+            connection.unregister_object(registration)
+
+    def on_method_call(self, connection, sender, object_path, interface_name,
+                       method_name, parameters, invocation):
+        # Holding the application so a D-Bus activated service stays around
+        # while it is being used
+        self.application.hold()
+        try:
+            if method_name == 'Compute':
+                result = self.compute(*parameters.unpack())
+                invocation.return_value(GLib.Variant('(a{sad}a{say})', result))
+            elif method_name == 'GetBands':
+                bands = {
+                  name: [text for text, style in metric.bands]
+                  for name, metric in engine.REGISTRY.items()
+                }
+                invocation.return_value(GLib.Variant('(a{sas})', (bands,)))
+        except ValueError as error:
+            invocation.return_dbus_error("org.freedesktop.DBus.Error.InvalidArgs", str(error))
+        except Exception as error:
+            # Anything else still answers the call, the caller would otherwise
+            # wait for its timeout
+            invocation.return_dbus_error("org.freedesktop.DBus.Error.Failed", str(error))
+        finally:
+            self.application.release()
+
+    # Returns ({metric: values}, {metric: band indices as bytes})
+    def compute(self, height, mass, waist, hip, age, gender):
+        rows = len(height)
+        if any(len(column) != rows for column in (mass, waist, hip, age, gender)):
+            raise ValueError("all input arrays must have the same length")
+        if engine.np is not None:
+            results = engine.compute_batch(height, mass, waist, hip, age, gender)
+            values = {metric: values.astype(float).tolist() for metric, (values, categories) in results.items()}
+            categories = {metric: categories.tobytes() for metric, (values, categories) in results.items()}
+            return values, categories
+        # Without NumPy the rows are computed one by one
+        values = {metric: [] for metric in engine.METRICS}
+        categories = {metric: bytearray() for metric in engine.METRICS}
+        for row in zip(height, mass, waist, hip, age, gender):
+            for metric, (value, category) in engine.compute(*row).items():
+                values[metric].append(float(value))
+                categories[metric].append(category & 0xff)
+        return values, {metric: bytes(indices) for metric, indices in categories.items()}
@@ -19,11 +19,18 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 # Imports
-from gi.repository import Adw, Gtk, Gdk, Gio
-import math
+from gi.repository import Adw, Gtk, Gdk, Gio, GLib
+from . import engine, history, labels, profiling
+from .engine import N_
+import sqlite3
+import time
 
 # Shorthand vars
 app_id = "io.github.philippkosarev.bmi"
+# Milliseconds without changes after which the state is saved
+save_delay = 1000
+# Settings forgotten on close when the forget button is active
+body_metrics = ["height", "mass", "gender", "age", "waist", "hip"]
 # Alignment
 start = Gtk.Align.START
 end = Gtk.Align.END
@@ -35,11 +42,22 @@ vertical = Gtk.Orientation.VERTICAL
 
 class BmiWindow(Adw.ApplicationWindow):
     __gtype_name__ = 'BmiWindow'
+    @profiling.timed('BmiWindow.__init__')
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # Loading GSettings and connecting action after closing the app window
+        # Loading GSettings and connecting action after closing the app window.
+        # Changes are collected and applied together by save_settings(), once
+        # the user stopped changing things for a while and on close.
         self.settings = Gio.Settings.new_with_path(app_id, "/io/github/philippkosarev/bmi/")
+        self.settings.delay()
+        self.save_timeout = None
         self.connect("close-request", self.on_close_window)
+        # Label tables of the window's language, the texts set through
+        # translate() and translate_list() are set again when it changes
+        self.labels = labels.get_table(self.settings["language"] or None)
+        self.gettext = self.labels.gettext
+        self.translated = []
+        self.translated_lists = []
 
         # Basic window properties
         self.set_title("BMI")
@@ -55,9 +73,19 @@ class BmiWindow(Adw.ApplicationWindow):
         self.content.add_top_bar(self.header)
         # About button
         self.about_button = Gtk.Button(icon_name="help-about-symbolic")
-        self.about_button.set_tooltip_text(_("Show About"))
+        self.translate(self.about_button.set_tooltip_text, N_("Show About"))
         self.about_button.connect('clicked', self.show_about)
         self.header.pack_end(self.about_button)
+        # Language menu
+        self.language_action = Gio.SimpleAction.new_stateful(
+            'language', GLib.VariantType.new('s'), GLib.Variant('s', self.settings["language"])
+        )
+        self.language_action.connect('change-state', self.on_language_action)
+        self.add_action(self.language_action)
+        self.language_button = Gtk.MenuButton(icon_name="preferences-desktop-locale-symbolic")
+        self.translate(self.language_button.set_tooltip_text, N_("Language"))
+        self.language_button.set_menu_model(self.create_language_menu())
+        self.header.pack_end(self.language_button)
         # Mode dropdown
         self.mode_dropdown = Gtk.DropDown()
         modes_list = Gtk.StringList()
@@ -73,13 +101,19 @@ class BmiWindow(Adw.ApplicationWindow):
         self.units_button = Gtk.ToggleButton(icon_name="ruler-angled-symbolic")
         self.units_button.set_active(self.settings["imperial"])
         self.units_button.connect('toggled', self.on_units_button)
-        self.units_button.set_tooltip_text(_("Switch to imperial units"))
+        self.translate(self.units_button.set_tooltip_text, N_("Switch to imperial units"))
         self.header.pack_start(self.units_button)
         # Forget button
         self.forget_button = Gtk.ToggleButton(icon_name="user-trash-full-symbolic")
         self.forget_button.set_active(self.settings["forget"])
-        self.forget_button.set_tooltip_text(_("Forget input values after closing"))
+        self.forget_button.connect('toggled', lambda _button: self.schedule_save())
+        self.translate(self.forget_button.set_tooltip_text, N_("Forget input values after closing"))
         self.header.pack_start(self.forget_button)
+        # History button
+        self.history_button = Gtk.ToggleButton(icon_name="document-open-recent-symbolic")
+        self.translate(self.history_button.set_tooltip_text, N_("Show history"))
+        self.history_button.connect('toggled', self.on_history_button)
+        self.header.pack_end(self.history_button)
 
         # WindowHandle to make the whole window draggable
         self.drag = Gtk.WindowHandle()
@@ -101,45 +135,14 @@ class BmiWindow(Adw.ApplicationWindow):
         self.inputs_page.set_size_request(300, 170)
         self.main_box.append(self.inputs_page)
         # Basic inputs group
-        self.inputs_group = Adw.PreferencesGroup(title=_("Inputs"))
+        self.inputs_group = Adw.PreferencesGroup(title=self.gettext("Inputs"))
         self.inputs_page.add(self.inputs_group)
         # Height input row
         self.height_adjustment = Gtk.Adjustment(lower=50, upper=267, step_increment=1, page_increment=10)
-        self.create_input_row("height_input_row", _("Height"), self.height_adjustment, 1, "Affects BMI and BRI", False)
+        self.create_input_row("height_input_row", N_("Height"), self.height_adjustment, 1, N_("Affects BMI and BRI"), False)
         # Weight input row
         self.weight_adjustment = Gtk.Adjustment(lower=10, upper=650, step_increment=1, page_increment=10)
-        self.create_input_row("weight_input_row", _("Weight"), self.weight_adjustment, 1, "Affects BMI", False)
-
-        # Advanced inputs root page
-        self.advanced_inputs_page = Adw.PreferencesPage(halign=center)
-        self.advanced_inputs_page.set_hexpand(True)
-        self.advanced_inputs_page.set_vexpand(True)
-        self.advanced_inputs_page.set_size_request(300, 330)
-        self.main_box.append(self.advanced_inputs_page)
-        # Advanced input group
-        self.advanced_inputs_group = Adw.PreferencesGroup(title=_("Advanced inputs"))
-        self.advanced_inputs_page.add(self.advanced_inputs_group)
-        # Gender input row
-        self.gender_adjustment = Adw.ComboRow(title=_("Gender"))
-        self.gender_adjustment.set_tooltip_text(_("Affects healthy/unhealthy thresholds for Waist to Hip ratio"))
-        gender_list = Gtk.StringList()
-        self.gender_adjustment.set_model(gender_list)
-        genders = [_("Average"), _("Female"), _("Male")]
-        for gender in genders:
-            gender_list.append(gender)
-        self.gender_adjustment.set_selected(self.settings["gender"])
-        self.gender_adjustment.connect('notify::selected-item', self.on_dropdown_value_changed)
-        self.advanced_inputs_group.add(self.gender_adjustment)
-        # Age input row
-        self.age_adjustment = Gtk.Adjustment(lower=18, upper=123, step_increment=1, page_increment=10)
-        self.create_input_row("age_input_row", _("Age"), self.age_adjustment, 0, _("Affects healthy/unhealthy thresholds for Waist to Height ratio"), True)
-        self.age_input_row.set_subtitle("Years")
-        # Waist circumference input row
-        self.waist_adjustment = Gtk.Adjustment(lower= 25, upper=650, step_increment=1, page_increment=10)
-        self.create_input_row("waist_input_row", _("Waist"), self.waist_adjustment, 1, _("Affects Waist to Height ratio, Waist to Hip ratio and BRI"), True)
-        # Hip circumference input row
-        self.hip_adjustment = Gtk.Adjustment(lower= 25, upper=650, step_increment=1, page_increment=10)
-        self.create_input_row("hip_input_row", _("Hip"), self.hip_adjustment, 1, _("Affects Waist to Hip ratio"), True)
+        self.create_input_row("weight_input_row", N_("Weight"), self.weight_adjustment, 1, N_("Affects BMI"), False)
 
         # Arrow icon
         self.icon = Gtk.Image(icon_name="go-next-symbolic", pixel_size=32)
@@ -153,12 +156,13 @@ class BmiWindow(Adw.ApplicationWindow):
         self.right_box.set_margin_end(8)
         self.main_box.append(self.right_box)
         # 'BMI:' label
-        self.result_label = Gtk.Label(label=_("BMI:"))
+        self.result_label = Gtk.Label()
+        self.translate(self.result_label.set_label, N_("BMI:"))
         self.result_label.add_css_class("title-2")
         self.right_box.append(self.result_label)
         # The button which shows the BMI number
         self.bmi_button = Gtk.Button(halign=center)
-        self.bmi_button.set_tooltip_text(_("Copy BMI"))
+        self.translate(self.bmi_button.set_tooltip_text, N_("Copy BMI"))
         self.bmi_button.set_css_classes(["pill", "title-1"])
         self.bmi_button.connect('clicked', self.clipboard_copy)
         self.bmi_button.set_size_request(110, 0)
@@ -168,38 +172,156 @@ class BmiWindow(Adw.ApplicationWindow):
         self.result_feedback_label.add_css_class("title-2")
         self.right_box.append(self.result_feedback_label)
 
+        # Widgets showing the feedback and the value of each metric, the
+        # advanced ones are added by build_advanced()
+        self.result_widgets = {
+          'basic_bmi': (self.result_feedback_label, self.bmi_button),
+        }
+        # Translated threshold bands by metric, the last entry is for
+        # engine.INVALID, which is -1
+        self.result_bands = self.labels.bands
+        # Metrics shown by the widgets, only these are computed
+        self.displayed = ('basic_bmi',)
+
+        # Last read inputs, calculated results and results shown by the widgets
+        self.inputs = {}
+        self.results = {}
+        self.shown = {}
+        # Pending input update and how long the slowest update took
+        self.input_tick = None
+        self.input_events = 0
+        self.input_updates = 0
+        self.slowest_update = 0
+
+        # The inputs are kept in centimetres and kilograms, the rows show them
+        # in the selected units
+        self.imperial = self.settings["imperial"]
+        self.height = self.settings["height"]
+        self.mass = self.settings["mass"]
+        self.waist = self.settings["waist"]
+        self.hip = self.settings["hip"]
+        self.age = self.settings["age"]
+        self.gender = self.settings["gender"]
+
+        # Connecting input rows
+        self.distance_rows = []
+        self.mass_rows = []
+        self.metrics_rows = []
+        self.input_names = {}
+        # Metric limits of the rows and the values they were last set to
+        self.input_limits = {}
+        self.view_values = {}
+        self.input_handlers = {}
+        self.connect_input_row(self.height_input_row, 'height')
+        self.connect_input_row(self.weight_input_row, 'mass')
+        profiling.watch(self.height_input_row, self.weight_input_row, self.bmi_button, self.result_feedback_label)
+        # The advanced widgets are only built once advanced mode is selected
+        self.advanced_inputs_page = None
+        # The history page is only built once it is shown
+        self.history_page = None
+        # Showing the inputs and updating all
+        self.convert_inputs()
+        self.update_all()
+
+    # Builds the advanced inputs and results, called the first time advanced
+    # mode is selected
+    @profiling.timed()
+    def build_advanced(self):
+        # Advanced inputs root page
+        self.advanced_inputs_page = Adw.PreferencesPage(halign=center)
+        self.advanced_inputs_page.set_hexpand(True)
+        self.advanced_inputs_page.set_vexpand(True)
+        self.advanced_inputs_page.set_size_request(300, 330)
+        self.main_box.insert_child_after(self.advanced_inputs_page, self.inputs_page)
+        # Advanced input group
+        self.advanced_inputs_group = Adw.PreferencesGroup()
+        self.translate(self.advanced_inputs_group.set_title, N_("Advanced inputs"))
+        self.advanced_inputs_page.add(self.advanced_inputs_group)
+        # Gender input row
+        self.gender_adjustment = Adw.ComboRow()
+        self.translate(self.gender_adjustment.set_title, N_("Gender"))
+        self.translate(self.gender_adjustment.set_tooltip_text, N_("Affects healthy/unhealthy thresholds for Waist to Hip ratio"))
+        self.gender_adjustment.set_model(Gtk.StringList())
+        self.translate_list(self.gender_adjustment, [N_("Average"), N_("Female"), N_("Male")], self.on_dropdown_value_changed)
+        self.gender_adjustment.set_selected(self.gender)
+        self.gender_adjustment.connect('notify::selected-item', self.on_dropdown_value_changed)
+        self.advanced_inputs_group.add(self.gender_adjustment)
+        # Age input row
+        self.age_adjustment = Gtk.Adjustment(lower=18, upper=123, step_increment=1, page_increment=10)
+        self.create_input_row("age_input_row", N_("Age"), self.age_adjustment, 0, N_("Affects healthy/unhealthy thresholds for Waist to Height ratio"), True)
+        self.age_input_row.set_subtitle("Years")
+        # Waist circumference input row
+        self.waist_adjustment = Gtk.Adjustment(lower= 25, upper=650, step_increment=1, page_increment=10)
+        self.create_input_row("waist_input_row", N_("Waist"), self.waist_adjustment, 1, N_("Affects Waist to Height ratio, Waist to Hip ratio and BRI"), True)
+        # Hip circumference input row
+        self.hip_adjustment = Gtk.Adjustment(lower= 25, upper=650, step_increment=1, page_increment=10)
+        self.create_input_row("hip_input_row", N_("Hip"), self.hip_adjustment, 1, N_("Affects Waist to Hip ratio"), True)
+
         # Advanced results root page
         self.right_page = Adw.PreferencesPage(halign=center)
         self.right_page.set_size_request(300, 330)
         self.right_page.set_margin_start(24)
         self.main_box.append(self.right_page)
         # Advanced results group
-        self.right_group = Adw.PreferencesGroup(title=_("Results"))
+        self.right_group = Adw.PreferencesGroup()
+        self.translate(self.right_group.set_title, N_("Results"))
         self.right_page.add(self.right_group)
-        # Result rows
-        self.create_result_row("result_bmi_row", "BMI", _("Body Mass Index"))
-        self.create_result_row("result_waist_to_height_row", _("Waist / Height"), _("Waist to height ratio"))
-        self.create_result_row("result_waist_to_hip_row", _("Waist / Hip"), _("Waist to hip ratio"))
-        self.create_result_row("result_bri_row", _("BRI"), _("Body Roundness Index"))
-
-        # Setting values for input rows
-        self.height_input_row.set_value(self.settings["height"])
-        self.weight_input_row.set_value(self.settings["mass"])
-        self.waist_input_row.set_value(self.settings["waist"])
-        self.hip_input_row.set_value(self.settings["hip"])
-        self.age_input_row.set_value(self.settings["age"])
-
-        # Connecting input rows
-        self.distance_rows = [self.height_input_row, self.waist_input_row, self.hip_input_row]
-        self.mass_rows = [self.weight_input_row]
-        self.metrics_rows = self.distance_rows + self.mass_rows
-        for row in self.metrics_rows:
-            row.connect('changed', self.on_input_changed)
-        # Updating all
-        self.update_all()
-        # Switching to imperial if needed
-        if self.imperial:
-            self.on_units_button(self)
+        # Result rows, one for every metric of the registry besides basic BMI
+        for metric in engine.REGISTRY.values():
+            if metric.name == 'basic_bmi':
+                continue
+            name = f"result_{metric.name}_row"
+            self.create_result_row(name, metric.title, metric.description)
+            self.result_widgets[metric.name] = (getattr(self, name), getattr(self, f"{name}_label"))
+        self.displayed = tuple(self.result_widgets)
+        # What-if heatmap, it needs NumPy to compute its grid
+        self.heatmap = None
+        if engine.np is not None:
+            from .heatmap import Heatmap
+            self.heatmap_group = Adw.PreferencesGroup()
+            self.translate(self.heatmap_group.set_title, N_("What if"))
+            self.translate(self.heatmap_group.set_description, N_("Height against weight"))
+            self.right_page.add(self.heatmap_group)
+            self.heatmap_dropdown = Gtk.DropDown(model=Gtk.StringList())
+            self.translate_list(self.heatmap_dropdown, [N_("BMI"), N_("BRI")], self.on_heatmap_dropdown)
+            self.heatmap_dropdown.set_valign(center)
+            self.heatmap_dropdown.connect('notify::selected', self.on_heatmap_dropdown)
+            self.heatmap_group.set_header_suffix(self.heatmap_dropdown)
+            self.heatmap = Heatmap()
+            self.heatmap.set_size_request(0, 200)
+            self.heatmap_group.add(self.heatmap)
+
+        # Connecting and showing the new rows
+        self.age_input_row.set_value(self.age)
+        self.connect_input_row(self.age_input_row)
+        self.connect_input_row(self.waist_input_row, 'waist')
+        self.connect_input_row(self.hip_input_row, 'hip')
+        profiling.watch(
+            self.gender_adjustment, self.age_input_row, self.waist_input_row, self.hip_input_row,
+            # The widgets of every advanced metric, basic BMI's are watched
+            # already
+            *(widget for metric, widgets in self.result_widgets.items() if metric != 'basic_bmi'
+              for widget in widgets)
+        )
+        self.convert_inputs()
+        self.update_units_labels()
+        self.update_inputs()
+        self.update_results()
+        self.update_result_labels()
+        self.update_heatmap()
+
+    # Connects a spin row, name is the attribute holding its metric value
+    # for rows showing a distance or mass
+    def connect_input_row(self, row, name=None):
+        self.input_handlers[row] = row.connect('changed', self.on_input_changed)
+        if name is None:
+            return
+        self.input_names[row] = name
+        self.metrics_rows.append(row)
+        if name == 'mass': self.mass_rows.append(row)
+        else:              self.distance_rows.append(row)
+        adjustment = row.get_adjustment()
+        self.input_limits[row] = (adjustment.get_lower(), adjustment.get_upper())
 
     def update_all(self):
         self.update_inputs()
@@ -208,218 +330,310 @@ class BmiWindow(Adw.ApplicationWindow):
         self.update_mode()
         self.update_units_labels()
 
+    # Reads the inputs and returns the names of the ones which changed since
+    # the last call
     def update_inputs(self):
-        # Getting relevant values
-        self.imperial = self.units_button.get_active()
-        self.height = self.height_input_row.get_value()
-        self.mass = self.weight_input_row.get_value()
-        self.waist = self.waist_input_row.get_value()
-        self.hip = self.hip_input_row.get_value()
-        self.gender = self.gender_adjustment.get_selected_item().get_string()
-        self.age = self.age_input_row.get_value()
-        # Converting imperial to metric
-        if self.imperial:
-            self.height = self.in_to_cm(self.height)
-            self.mass = self.lb_to_kg(self.mass)
-            self.waist = self.in_to_cm(self.waist)
-            self.hip = self.in_to_cm(self.hip)
-
-        self.height_input_row.set_title(_("Height"))
-        self.weight_input_row.set_title(_("Weight"))
-        if self.height == 267:
-            self.height_input_row.set_title("Robert Wadlow")
-        if self.mass == 650:
-            self.weight_input_row.set_title("Jon Brower Minnoch")
-
-    def update_results(self):
-        # Calculating BMI
-        self.bmi = self.mass / ((self.height / 100) ** 2)
-        # Calculating Waist to Height ratio
-        self.waist_to_height = self.waist / self.height
-        # Calculating Waist to Hip ratio
-        self.waist_to_hip = self.waist / self.hip
-        # Calculating BRI
-        try:
-            self.bri = 364.2 - (365.5 * math.sqrt((1 - (self.waist / (math.pi * self.height)) ** 2)))
-        except:
-            self.bri = 0
-        # Sometimes '1 - (self.waist / (math.pi * self.height)' < 0 so sqrt() errors out
+        # Getting relevant values, a row only changes the metric value it
+        # shows when the user changed it, so switching units never drifts
+        for row, name in self.input_names.items():
+            value = row.get_value()
+            if value != self.view_values.get(row):
+                self.view_values[row] = value
+                setattr(self, name, self.to_metric(name, value))
+        if self.advanced_inputs_page is not None:
+            self.gender = self.gender_adjustment.get_selected()
+            self.age = self.age_input_row.get_value()
+
+        inputs = {
+          'height': self.height, 'mass': self.mass, 'waist': self.waist,
+          'hip': self.hip, 'age': self.age, 'gender': self.gender,
+        }
+        changed = {name for name, value in inputs.items() if self.inputs.get(name) != value}
+        self.inputs = inputs
+
+        if 'height' in changed or 'mass' in changed:
+            self.update_input_titles()
+        return changed
+
+    # The height and weight rows are named after the record holders at their
+    # maximum
+    def update_input_titles(self):
+        title = "Robert Wadlow" if self.height == 267 else self.gettext("Height")
+        if title != self.height_input_row.get_title():
+            self.height_input_row.set_title(title)
+        title = "Jon Brower Minnoch" if self.mass == 650 else self.gettext("Weight")
+        if title != self.weight_input_row.get_title():
+            self.weight_input_row.set_title(title)
+
+    # Recalculates the metrics depending on the changed inputs, or all of them
+    # if none are given, and returns which ones were recalculated
+    @profiling.timed()
+    def update_results(self, changed=None):
+        metrics = engine.METRICS if changed is None else engine.get_dirty(changed)
+        metrics = [metric for metric in metrics if metric in self.displayed]
+        if metrics:
+            # Going through the cache with the metric values, the units are
+            # only how the rows show them and never change a result
+            inputs = [getattr(self, name) for name in engine.INPUTS]
+            results = engine.compute_cached(*inputs, metrics=metrics)
+            for metric in metrics:
+                self.results[metric] = results[metric]
+        return metrics
 
     # Hides or shows simple and advanced input and output widgets depending on the selected mode
     def update_mode(self):
         if self.mode_dropdown.get_selected() == 0:
-            self.advanced_inputs_page.set_visible(False)
-            self.right_page.set_visible(False)
+            if self.advanced_inputs_page is not None:
+                self.advanced_inputs_page.set_visible(False)
+                self.right_page.set_visible(False)
             self.right_box.set_visible(True)
             self.inputs_group.set_title("")
         else:
+            if self.advanced_inputs_page is None:
+                self.build_advanced()
             self.advanced_inputs_page.set_visible(True)
             self.right_page.set_visible(True)
             self.right_box.set_visible(False)
-            self.inputs_group.set_title(_("Inputs"))
-
-    # Action, called after value of self.height_input_row or other inputs changes
-    def on_input_changed(self, _scroll):
-        self.update_inputs()
-        self.update_results()
-        self.update_result_labels()
-
-    # Action, called after value of self.mode_dropdown changes
+            self.inputs_group.set_title(self.gettext("Inputs"))
+
+    # Regenerates the heatmap if an input it depends on changed, otherwise
+    # only moves its marker
+    @profiling.timed()
+    def update_heatmap(self):
+        if self.advanced_inputs_page is None or self.heatmap is None:
+            return
+        metric = ['bmi', 'bri'][self.heatmap_dropdown.get_selected()]
+        self.heatmap.update(metric, self.inputs)
+
+    def on_heatmap_dropdown(self, dropdown, _pspec):
+        self.update_heatmap()
+
+    # Called by self.history_button, shows or hides the trend chart next to the results
+    def on_history_button(self, button):
+        if self.history_page is None:
+            # History page
+            self.history_page = Adw.PreferencesPage(halign=center)
+            self.history_page.set_size_request(400, 330)
+            self.history_page.set_margin_start(24)
+            self.main_box.append(self.history_page)
+            # History group
+            self.history_group = Adw.PreferencesGroup()
+            self.translate(self.history_group.set_title, N_("History"))
+            self.history_page.add(self.history_group)
+            # Trend chart, imported here so cairo is only loaded when needed
+            from .chart import TrendChart
+            self.trend_chart = TrendChart()
+            self.trend_chart.set_size_request(360, 260)
+            self.trend_chart.add_css_class("card")
+            self.history_group.add(self.trend_chart)
+        self.history_page.set_visible(button.get_active())
+
+    # Action, called after value of self.height_input_row or other inputs changes.
+    # Holding a key or scrolling changes inputs many times per frame, so the
+    # update waits for the next frame and uses the values the rows have then.
+    @profiling.timed()
+    def on_input_changed(self, *_args):
+        self.input_events += 1
+        if self.input_tick is None:
+            self.input_tick = self.add_tick_callback(self.on_input_tick)
+
+    def on_input_tick(self, _widget, _frame_clock):
+        self.input_tick = None
+        self.flush_inputs()
+        return GLib.SOURCE_REMOVE
+
+    # Runs a pending input update right away
+    @profiling.timed()
+    def flush_inputs(self):
+        if self.input_tick is not None:
+            self.remove_tick_callback(self.input_tick)
+            self.input_tick = None
+        start = time.perf_counter()
+        changed = self.update_inputs()
+        metrics = self.update_results(changed)
+        self.update_result_labels(metrics)
+        if changed:
+            self.update_heatmap()
+        self.input_updates += 1
+        self.slowest_update = max(self.slowest_update, time.perf_counter() - start)
+        if changed:
+            self.schedule_save()
+
+    # Action, called after value of self.mode_dropdown or self.gender_adjustment changes
     def on_dropdown_value_changed(self, dropdown, _pspec):
-        self.update_mode()
-        self.update_results()
+        if dropdown is self.mode_dropdown:
+            self.update_mode()
+            self.schedule_save()
+        else:
+            self.flush_inputs()
 
-    # Called by self.units_button
+    # Called by self.units_button, only the shown values change so the
+    # results are recalculated once
+    @profiling.timed()
     def on_units_button(self, _button):
-        self.update_inputs()
+        self.flush_inputs()
+        self.imperial = self.units_button.get_active()
         self.convert_inputs()
         self.update_units_labels()
         self.update_results()
         self.update_result_labels()
+        self.schedule_save()
 
     # Changes input rows' subtitles to cm/kg or in/ft
     def update_units_labels(self):
         # Setting vars
         if self.imperial is False:
-            distance = _("Centimetres")
-            mass = _("Kilograms")
+            distance = self.gettext("Centimetres")
+            mass = self.gettext("Kilograms")
         else:
-            distance = _("Inches")
-            mass = _("Pounds")
+            distance = self.gettext("Inches")
+            mass = self.gettext("Pounds")
         # Setting subtitles
         for row in self.distance_rows:
             row.set_subtitle(distance)
         for row in self.mass_rows:
             row.set_subtitle(mass)
 
-    # Converting row adjustment limits and values
+    # Converting between the units shown by a row and centimetres/kilograms
+    def to_metric(self, name, value):
+        if not self.imperial:
+            return value
+        if name == 'mass':
+            return engine.lb_to_kg(value)
+        return engine.in_to_cm(value)
+    def to_view(self, name, value):
+        if not self.imperial:
+            return value
+        if name == 'mass':
+            return engine.kg_to_lb(value)
+        return engine.cm_to_in(value)
+
+    # Showing the metric inputs and limits in the selected units, without
+    # emitting 'changed' for every row
+    @profiling.timed()
     def convert_inputs(self):
-        # Helper functions
-        def row_get_limits(row):
-            return [row.get_adjustment().get_lower(), row.get_adjustment().get_upper()]
-        def row_set_limits(row, limits):
-            row.get_adjustment().set_lower(limits[0])
-            row.get_adjustment().set_upper(limits[1])
-        # Defining conversions
-        if self.imperial is False:
-            convert_distance = self.in_to_cm
-            convert_mass = self.lb_to_kg
-        else:
-            convert_distance = self.cm_to_in
-            convert_mass = self.kg_to_lb
-        # Setting limits and values
-        for row in self.distance_rows:
-            limits = row_get_limits(row)
-            for i in range(len(limits)): limits[i] = round(convert_distance(limits[i]), 1)
-            row_set_limits(row, limits)
-            row.set_value(convert_distance(round(row.get_value(), 1)))
-        for row in self.mass_rows:
-            limits = row_get_limits(row)
-            for i in range(len(limits)): limits[i] = round(convert_mass(limits[i]), 1)
-            row_set_limits(row, limits)
-            row.set_value(convert_mass(round(row.get_value(), 1)))
-
-    def get_results(self):
-        # Getting dynamic values
-        def get_whtr_unhealthy():
-            if self.age > 40:   return ((self.age-40)/100)+0.5
-            elif self.age > 50: return 0.6
-            else:               return 0.5
-        def get_whr_overweight():
-            if self.gender == "Female": return 0.8
-            elif self.gender == "Male": return 0.9
-            else:                       return 0.85
-        def get_whr_obese():
-          if self.gender == "Female": return 0.85
-          elif self.gender == "Male": return 1
-          else:                       return 0.925
-        # Returning results
-        return {
-          'basic_bmi': {
-            'widget': self.result_feedback_label,
-            'label':  self.bmi_button,
-            'value':  int(round(self.bmi, 0)),
-            'thresholds': [
-              {'text': _('Underweight'),     'value': 0,    'style': 'light-blue'},
-              {'text': _('Healthy'),         'value': 18.5, 'style': 'success'},
-              {'text': _('Overweight'),      'value': 25,   'style': 'warning'},
-              {'text': _('Obese'),           'value': 30,   'style': 'error'},
-              {'text': _('Extremely obese'), 'value': 40,   'style': 'error'},
-            ]
-          },
-          'bmi': {
-            'widget': self.result_bmi_row,
-            'label': self.result_bmi_row_label,
-            'value':  round(self.bmi, 1),
-            'thresholds': [
-              {'text': _('Underweight [Severe]'),   'value': 0,    'style': 'light-blue'},
-              {'text': _('Underweight [Moderate]'), 'value': 16,   'style': 'light-blue'},
-              {'text': _('Underweight [Mild]'),     'value': 17,   'style': 'light-blue'},
-              {'text': _('Healthy'),                'value': 18.5, 'style': 'success'},
-              {'text': _('Overweight'),             'value': 25,   'style': 'warning'},
-              {'text': _('Obese [Class 1]'),        'value': 30,   'style': 'error'},
-              {'text': _('Obese [Class 2]'),        'value': 35,   'style': 'error'},
-              {'text': _('Obese [Class 3]'),        'value': 40,   'style': 'error'},
-            ]
-          },
-          'whtr': {
-            'widget': self.result_waist_to_height_row,
-            'label': self.result_waist_to_height_row_label,
-            'value':  round(self.waist_to_height, 2),
-            'thresholds': [
-              {'text': _('Healthy'),   'value': 0,                    'style': 'success'},
-              {'text': _('Unhealthy'), 'value': get_whtr_unhealthy(), 'style': 'warning'},
-            ]
-          },
-          'whr': {
-            'widget': self.result_waist_to_hip_row,
-            'label': self.result_waist_to_hip_row_label,
-            'value':  round(self.waist_to_hip, 2),
-            'thresholds': [
-              {'text': _('Healthy'),    'value': 0,                    'style': 'success'},
-              {'text': _('Overweight'), 'value': get_whr_overweight(), 'style': 'warning'},
-              {'text': _('Obese'),      'value': get_whr_obese(),      'style': 'error'},
-            ]
-          },
-          'bri': {
-            'widget': self.result_bri_row,
-            'label': self.result_bri_row_label,
-            'value':  round(self.bri, 2),
-            'thresholds': [
-              {'text': _('Very lean'),     'value': 0,    'style': 'light-blue'},
-              {'text': _('Lean'),          'value': 3.41, 'style': 'success'},
-              {'text': _('Average'),       'value': 4.45, 'style': 'success'},
-              {'text': _('Above average'), 'value': 5.46, 'style': 'warning'},
-              {'text': _('High'),          'value': 6.91, 'style': 'error'},
-            ]
-          },
-        }
-
-    def update_result_labels(self):
-        def clear_css(widget):
-            widget.remove_css_class("light-blue")
-            widget.remove_css_class("success")
-            widget.remove_css_class("warning")
-            widget.remove_css_class("error")
-        results = self.get_results()
-        for item in results:
-          widget = results.get(item).get('widget')
-          label = results.get(item).get('label')
-          value = results.get(item).get('value')
-          label.set_label(str(value))
-          thresholds = results.get(item).get('thresholds')
-          for threshold in thresholds:
-              threshold_value = threshold.get('value')
-              text = threshold.get('text')
-              style = threshold.get('style')
-              if value >= threshold_value:
-                  clear_css(widget)
-                  if widget.get_name() == "GtkLabel":
-                      widget.set_label(text)
-                      widget.add_css_class(style)
-                  if widget.get_name() == "AdwActionRow":
-                      widget.set_subtitle(text)
-                      widget.add_css_class(style)
+        for row, name in self.input_names.items():
+            adjustment = row.get_adjustment()
+            lower, upper = (round(self.to_view(name, limit), 1) for limit in self.input_limits[row])
+            value = self.to_view(name, getattr(self, name))
+            row.handler_block(self.input_handlers[row])
+            adjustment.configure(
+                value, lower, upper, adjustment.get_step_increment(),
+                adjustment.get_page_increment(), adjustment.get_page_size()
+            )
+            row.handler_unblock(self.input_handlers[row])
+            self.view_values[row] = row.get_value()
+
+    # Yields (metric, widget, label, value, category) of the given metrics
+    def get_results(self, metrics=engine.METRICS):
+        for metric in metrics:
+            if metric not in self.result_widgets:
+                continue
+            value, category = self.results[metric]
+            widget, label = self.result_widgets[metric]
+            yield metric, widget, label, value, category
+
+    # Updates the result widgets, only touching what differs from what they
+    # already show
+    @profiling.timed()
+    def update_result_labels(self, metrics=engine.METRICS):
+        for metric, widget, label, value, category in self.get_results(metrics):
+            shown_value, shown_category = self.shown.get(metric, (None, None))
+            value = self.format_result(metric, value, category)
+            if value != shown_value:
+                label.set_label(value)
+            if category != shown_category:
+                text, style = self.result_bands[metric][category]
+                if shown_category is not None:
+                    shown_style = self.result_bands[metric][shown_category][1]
+                    if shown_style != style:
+                        if shown_style is not None:
+                            widget.remove_css_class(shown_style)
+                if style is not None:
+                    widget.add_css_class(style)
+                self.set_band_text(widget, text)
+            self.shown[metric] = (value, category)
+
+    # Shows the band a result falls into below the basic BMI or as the
+    # subtitle of an advanced result row
+    def set_band_text(self, widget, text):
+        if widget.get_name() == "GtkLabel":
+            widget.set_label(text)
+        if widget.get_name() == "AdwActionRow":
+            widget.set_subtitle(text)
+
+    # Sets a text through a setter in the window's language and remembers
+    # it, so set_language() can set it again
+    def translate(self, setter, message):
+        self.translated.append((setter, message))
+        setter(self.gettext(message))
+
+    # Same for the strings of a drop-down or combo row, whose selection
+    # handler is given so it can be blocked while they are replaced
+    def translate_list(self, widget, messages, handler):
+        self.translated_lists.append((widget, messages, handler))
+        self.set_list_strings(widget, messages, None)
+
+    # Replaces the strings of a widget's Gtk.StringList, keeping what is
+    # selected without the handler seeing the change
+    def set_list_strings(self, widget, messages, handler):
+        model = widget.get_model()
+        selected = widget.get_selected()
+        if handler is not None:
+            widget.handler_block_by_func(handler)
+        try:
+            model.splice(0, model.get_n_items(), [self.gettext(message) for message in messages])
+            if selected < model.get_n_items():
+                widget.set_selected(selected)
+        finally:
+            if handler is not None:
+                widget.handler_unblock_by_func(handler)
+
+    # Switches the window to the label tables of another language, None for
+    # the one of the environment, without rebuilding any widgets
+    @profiling.timed()
+    def set_language(self, language):
+        self.labels = labels.get_table(language)
+        self.gettext = self.labels.gettext
+        self.result_bands = self.labels.bands
+        for setter, message in self.translated:
+            setter(self.gettext(message))
+        for widget, messages, handler in self.translated_lists:
+            self.set_list_strings(widget, messages, handler)
+        self.update_input_titles()
+        self.update_units_labels()
+        if self.inputs_group.get_title():
+            self.inputs_group.set_title(self.gettext("Inputs"))
+        for metric, widget, label, value, category in self.get_results(list(self.shown)):
+            self.set_band_text(widget, self.result_bands[metric][category][0])
+        self.language_button.set_menu_model(self.create_language_menu())
+
+    # Languages there is a catalog for, besides the one of the environment
+    def create_language_menu(self):
+        menu = Gio.Menu()
+        names = [("", self.gettext("System"))]
+        names += [(language, labels.get_language_name(language)) for language in labels.get_languages()]
+        for language, name in names:
+            item = Gio.MenuItem.new(name, None)
+            item.set_action_and_target_value('win.language', GLib.Variant('s', language))
+            menu.append_item(item)
+        return menu
+
+    def on_language_action(self, action, value):
+        action.set_state(value)
+        self.settings["language"] = value.get_string()
+        self.set_language(value.get_string() or None)
+        self.schedule_save()
+
+    # Result value as shown, with the metric's unit and masses in pounds in
+    # imperial mode
+    def format_result(self, metric, value, category):
+        if category == engine.INVALID:
+            return "—"
+        unit = engine.REGISTRY[metric].unit
+        if unit == 'kg' and self.imperial:
+            value, unit = round(engine.kg_to_lb(value), engine.DIGITS[metric]), 'lb'
+        return f"{value} {unit}" if unit else str(value)
 
         # Creates a spin row and adds it to either self.inputs_group or advanced_inputs_group
     def create_input_row(self, widgetName, title, adjustment, digits, tooltip, advanced):
@@ -427,8 +641,8 @@ class BmiWindow(Adw.ApplicationWindow):
         setattr(self, widgetName, Adw.SpinRow())
         self.widget = getattr(self, widgetName)
         # Customizing the SpinRow
-        self.widget.set_title(title)
-        self.widget.set_tooltip_text(tooltip)
+        self.translate(self.widget.set_title, title)
+        self.translate(self.widget.set_tooltip_text, tooltip)
         self.widget.set_adjustment(adjustment)
         self.widget.set_digits(digits)
         # Deciding where to add the row
@@ -442,9 +656,9 @@ class BmiWindow(Adw.ApplicationWindow):
         self.widget = getattr(self, widgetName)
         self.label = getattr(self, f"{widgetName}_label")
         self.widget.set_activatable(True)
-        self.widget.set_title(title)
+        self.translate(self.widget.set_title, title)
         self.widget.connect("activated", self.clipboard_copy)
-        self.widget.set_tooltip_text(tooltip)
+        self.translate(self.widget.set_tooltip_text, tooltip)
         self.widget.add_css_class("heading")
         self.label.set_css_classes(["title-3"])
         # self.label.set_label("21")
@@ -469,15 +683,9 @@ class BmiWindow(Adw.ApplicationWindow):
         print(f"Copied result '{value}'")
         Gdk.Clipboard.set(clipboard, value);
         # Creating and showing a toast
-        self.toast = Adw.Toast(title=_("Result copied"), timeout=1)
+        self.toast = Adw.Toast(title=self.gettext("Result copied"), timeout=1)
         self.toast_overlay.add_toast(self.toast)
 
-    # For easier conversions
-    def in_to_cm(self, value): value *= 2.54; return value
-    def cm_to_in(self, value): value *= 0.3937008; return value
-    def kg_to_lb(self, value): value *= 2.204623; return value
-    def lb_to_kg(self, value): value *= 0.4535924; return value
-
     # Show the About app dialog
     def show_about(self, _button):
         self.about = Adw.AboutWindow(
@@ -493,22 +701,76 @@ class BmiWindow(Adw.ApplicationWindow):
         issue_url        = "https://github.com/philippkosarev/bmi/issues"
         ); self.about.present()
 
-    # Action after closing the app window
+    # Saves the state once nothing changed for save_delay, so a crash loses
+    # at most the last moment of editing
+    def schedule_save(self):
+        if self.save_timeout is not None:
+            GLib.source_remove(self.save_timeout)
+        self.save_timeout = GLib.timeout_add(save_delay, self.on_save_timeout)
+
+    def on_save_timeout(self):
+        self.save_timeout = None
+        self.save_settings()
+        return GLib.SOURCE_REMOVE
+
+    # Puts the state into the delayed settings, only the values which differ
+    # from the stored ones, and applies them all in one write
+    @profiling.timed()
+    def save_settings(self):
+        if self.save_timeout is not None:
+            GLib.source_remove(self.save_timeout)
+            self.save_timeout = None
+        state = {
+            "mode": self.mode_dropdown.get_selected(),
+            "forget": self.forget_button.get_active(),
+            "imperial": self.units_button.get_active(),
+            # Body metrics
+            "height": round(self.height, 0),
+            "mass": round(self.mass, 0),
+            "waist": round(self.waist, 0),
+            "hip": round(self.hip, 0),
+            # Age and gender
+            "age": int(self.age),
+            "gender": self.gender,
+        }
+        for key, value in state.items():
+            # The measurements aren't kept at all if forget button is active
+            if key in body_metrics and state["forget"]:
+                if self.settings.get_user_value(key) is not None:
+                    self.settings.reset(key)
+            elif self.settings[key] != value:
+                self.settings[key] = value
+        if self.settings.get_has_unapplied():
+            self.settings.apply()
+
+    # Action after closing the app window, saves the state and waits for it
+    # to be written. Unless the forget button is active the measurements are
+    # added to the history.
+    @profiling.timed()
     def on_close_window(self, widget, *args):
-        # Setting gsettings values to adjustments to use them on next launch
-        self.settings["mode"] = self.mode_dropdown.get_selected()
-        self.settings["forget"] = self.forget_button.get_active()
-        self.settings["imperial"] = self.units_button.get_active()
-        # Body metrics
-        self.settings["height"] = round(self.height, 0)
-        self.settings["mass"] = round(self.mass, 0)
-        self.settings["waist"] = round(self.waist, 0)
-        self.settings["hip"] = round(self.hip, 0)
-        # Age and gender
-        self.settings["age"] = self.age_input_row.get_value()
-        self.settings["gender"] = self.gender_adjustment.get_selected()
-        # Resets adjustments if forget button is active
-        body_metrics=["height", "mass", "gender", "age", "waist", "hip"]
-        if self.settings["forget"] is True:
-            for body_metric in body_metrics:
-                self.settings.reset(body_metric)
+        self.flush_inputs()
+        self.save_settings()
+        Gio.Settings.sync()
+        if not self.forget_button.get_active():
+            self.save_history()
+
+    # Adds the session's measurements to the history in one write, unless
+    # they are the same as the last ones in it
+    def save_history(self):
+        entry = {name: getattr(self, name) for name in history.COLUMNS[:6]}
+        # The history keeps these whether or not the window showed them
+        metrics = ['bmi', 'whtr', 'whr', 'bri']
+        # The same way as the window, so the history has what it showed
+        results = engine.compute_cached(*[entry[name] for name in engine.INPUTS], metrics=metrics)
+        for metric in metrics:
+            entry[metric] = results[metric][0]
+        try:
+            store = history.History()
+            try:
+                last = store.last()
+                if last is None or list(last[1:7]) != [entry[name] for name in history.COLUMNS[:6]]:
+                    store.append([entry])
+            finally:
+                store.close()
+        except sqlite3.Error as error:
+            print(f"Could not save history: {error}")
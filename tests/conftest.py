@@ -0,0 +1,38 @@
+# conftest.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Makes the source directory importable as the 'bmi' package, the way it is
+# installed, so the tests run from a checkout
+
+# Imports
+import gettext
+import importlib.util
+import os
+import sys
+
+src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if 'bmi' not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        'bmi', os.path.join(src, '__init__.py'), submodule_search_locations=[src]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['bmi'] = package
+    spec.loader.exec_module(package)
+gettext.install('bmi')
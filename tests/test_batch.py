@@ -0,0 +1,120 @@
+# test_batch.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Tests of the batch mode's parsing and output, the results themselves are
+# covered by test_conformance.py
+
+# Imports
+import csv
+import io
+import pytest
+from bmi import batch, engine
+
+# The defaults are metric, only the given imperial values are converted
+def test_imperial_defaults():
+    height, mass, waist, hip, age, gender = batch.parse_record({'height': '70', 'mass': '160'}, True)
+    assert (height, mass) == (engine.in_to_cm(70), engine.lb_to_kg(160))
+    assert (waist, hip, age, gender) == (70, 85, 30, engine.AVERAGE)
+    values = batch.parse_record({'height': '70', 'mass': '160', 'waist': '32'}, True)
+    assert values[2] == engine.in_to_cm(32)
+
+@pytest.mark.parametrize('record, message', [
+    ({'height': '0', 'mass': '75'}, "'height' is not positive"),
+    ({'height': '180', 'mass': '-1'}, "'mass' is not positive"),
+    ({'height': 'nan', 'mass': '75'}, "'height' is not a finite number"),
+    ({'height': '180', 'mass': 'inf'}, "'mass' is not a finite number"),
+    ({'height': '180', 'mass': '75', 'age': '-1'}, "'age' is negative"),
+    ({'height': '180', 'mass': '75', 'gender': 1e30}, "unknown gender '1e+30'"),
+    ({'height': '180', 'mass': '75', 'gender': '3'}, "unknown gender '3'"),
+    ({'height': '180'}, "missing 'mass'"),
+    ([180, 75], "not an object"),
+    ("x", "not an object"),
+])
+def test_invalid_records(record, message):
+    with pytest.raises(ValueError) as error:
+        batch.parse_columns([{'height': '180', 'mass': '75'}, record], first_line=5)
+    assert str(error.value) == f"record 6: {message}"
+
+def test_invalid_jsonl():
+    with pytest.raises(ValueError, match="record 2: not an object"):
+        batch.run(io.StringIO('{"height": 180, "mass": 75}\n[1, 2]\n'), io.StringIO(), 'jsonl', 'jsonl')
+
+# A quoted field holding a line break stays one record
+def test_quoted_newlines():
+    text = 'name,height,mass\n"Doe,\nJane",180,75\nSmith,170,60\n'
+    output = io.StringIO()
+    count, invalid = batch.run(io.StringIO(text, newline=''), output, 'csv', 'csv', metrics=['bmi'], chunk_size=1)
+    rows = list(csv.DictReader(io.StringIO(output.getvalue(), newline='')))
+    assert count == 2
+    assert [row['name'] for row in rows] == ["Doe,\nJane", "Smith"]
+    assert [row['bmi'] for row in rows] == ['23.1', '20.8']
+
+# Chunks scored on a process pool are written in input order
+@pytest.mark.skipif(engine.np is None, reason="NumPy is not installed")
+@pytest.mark.parametrize('input_format', ['csv', 'jsonl'])
+def test_jobs_order(input_format):
+    records = [{'height': 150 + index % 50, 'mass': 40 + index % 70, 'waist': 60 + index % 40} for index in range(500)]
+    if input_format == 'csv':
+        text = 'height,mass,waist\n' + ''.join(f"{record['height']},{record['mass']},{record['waist']}\n" for record in records)
+    else:
+        text = batch.format_records(records, None, 'jsonl')
+    outputs = []
+    for jobs in (1, 3):
+        output = io.StringIO()
+        count, invalid = batch.run(io.StringIO(text), output, input_format, input_format, chunk_size=7, jobs=jobs)
+        assert count == len(records)
+        outputs.append(output.getvalue())
+    assert outputs[0] == outputs[1]
+    assert outputs[0].count('\n') == len(records) + (input_format == 'csv')
+
+@pytest.mark.parametrize('argv', [['--chunk-size', '0'], ['-j', '-2'], ['--jobs', 'all']])
+def test_invalid_counts(argv, capsys):
+    with pytest.raises(SystemExit):
+        batch.create_parser().parse_args(argv)
+    assert argv[0] in capsys.readouterr().err
+
+def test_invalid_first_record():
+    with pytest.raises(ValueError, match="record 1: not an object"):
+        batch.run(io.StringIO('5\n{"height": 180, "mass": 75}\n'), io.StringIO(), 'jsonl', 'jsonl')
+
+# Malformed lines are reported by their record number, blank lines aren't
+# records
+def test_malformed_jsonl():
+    text = '{"height": 180, "mass": 75}\n\n{"height": 170, "mass": 70}\n{"height": 170,\n'
+    with pytest.raises(ValueError, match="^record 3: Expecting property name"):
+        batch.run(io.StringIO(text), io.StringIO(), 'jsonl', 'jsonl', chunk_size=2)
+
+def test_missing_file(tmp_path, capsys):
+    assert batch.main(['bmi', '--batch', str(tmp_path / 'missing.csv')]) == 1
+    assert 'missing.csv' in capsys.readouterr().err
+
+# Without NumPy the records are scored one by one, with the same output
+@pytest.mark.skipif(engine.np is None, reason="NumPy is not installed")
+@pytest.mark.parametrize('output_format', ['csv', 'jsonl'])
+def test_without_numpy(output_format, monkeypatch):
+    text = "height,mass,waist,gender\n180,75,80,male\n50,20,200,female\n165.5,60.2,,\n"
+    outputs = []
+    for np in (engine.np, None):
+        monkeypatch.setattr(engine, 'np', np)
+        output = io.StringIO()
+        assert batch.run(io.StringIO(text), output, 'csv', output_format, languages=['de']) == (3, 1)
+        outputs.append(output.getvalue())
+    assert outputs[0] == outputs[1]
+    assert batch.main(['bmi', '--batch', '-o', 'results.npy']) == 1
@@ -0,0 +1,69 @@
+# test_columnar.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+
+# Tests of the columnar output of the batch mode, read back the way
+# downstream tools would
+
+# Imports
+import io
+import math
+import pytest
+from bmi import batch, columnar, engine
+
+pytestmark = pytest.mark.skipif(engine.np is None, reason="NumPy is not installed")
+
+records = [
+    {'height': 150 + index, 'mass': 45 + index, 'waist': 4 * (150 + index) if index % 7 == 3 else 70 + index, 'age': 20 + index}
+    for index in range(23)
+]
+
+def get_text():
+    return 'height,mass,waist,age\n' + ''.join(
+        f"{record['height']},{record['mass']},{record['waist']},{record['age']}\n" for record in records
+    )
+
+# Streamed over several chunks, the header is rewritten with the final
+# number of rows and the file can be memory-mapped
+def test_npy_round_trip(tmp_path):
+    np = engine.np
+    path = tmp_path / 'results.npy'
+    with open(path, 'wb') as output:
+        count, invalid = batch.run(io.StringIO(get_text()), output, 'csv', 'npy', chunk_size=5)
+    assert (count, invalid) == (len(records), 3)
+    with open(path, 'rb') as file:
+        assert np.lib.format.read_magic(file) == (1, 0)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        assert file.tell() == columnar.npy_header_size
+    assert shape == (len(records),)
+    assert dtype == columnar.get_dtype()
+    table = np.load(path, mmap_mode='r')
+    assert isinstance(table, np.memmap)
+    assert table.shape == (len(records),)
+    expected = batch.score([dict(record) for record in records])
+    assert table['height'].tolist() == [record['height'] for record in records]
+    for metric in engine.METRICS:
+        for value, record in zip(table[metric], expected):
+            if record[metric] is None:
+                assert math.isnan(value)
+            else:
+                assert value == record[metric]
+    assert (table['bri_category'] == engine.INVALID).sum() == 3
+    assert table['bri_reason'][3] == engine.BRI_REASONS.index(expected[3]['bri_reason'])
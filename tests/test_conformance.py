@@ -0,0 +1,314 @@
+# test_conformance.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Differential tests of every way results are computed against each other
+# and against reference(), the formulas and thresholds the window used before
+# they moved into the engine:
+#
+#   engine.compute()         the scalar path
+#   engine.compute_cached()  the window's path, in metric and imperial units
+#   engine.compute_batch()   the vectorized path of the batch mode and D-Bus
+#   batch.score()            the batch mode from parsed text records
+#
+# The reference covers the metrics the window had before the registry, the
+# ones added with it are checked against known values and between the paths.
+# The golden file pins hand-picked edge cases. The generated inputs are
+# seeded, BMI_CONFORMANCE_ROWS sets how many there are (200000 by default,
+# use millions before trusting a change to a fast path).
+
+# Imports
+import csv
+import io
+import json
+import math
+import os
+import random
+import pytest
+from bmi import batch, engine
+
+np = engine.np
+needs_numpy = pytest.mark.skipif(np is None, reason="NumPy is not installed")
+
+golden_path = os.path.join(os.path.dirname(__file__), 'golden', 'conformance.json')
+original = ['basic_bmi', 'bmi', 'whtr', 'whr', 'bri']
+rows = int(os.environ.get('BMI_CONFORMANCE_ROWS', 200000))
+
+# Ranges of the window's input rows in centimetres, kilograms and years
+ranges = {
+    'height': (50, 267),
+    'mass':   (10, 650),
+    'waist':  (25, 650),
+    'hip':    (25, 650),
+    'age':    (18, 123),
+}
+
+# The window's calculation before the engine existed, kept as the reference.
+# Values below the first threshold keep the first band, like the engine does,
+# and where the square root of BRI fails it is undefined instead of 0.
+def reference(height, mass, waist, hip, age, gender):
+    bmi = mass / ((height / 100) ** 2)
+    try:
+        bri = 364.2 - (365.5 * math.sqrt((1 - (waist / (math.pi * height)) ** 2)))
+    except ValueError:
+        bri = math.nan
+    if age > 40: whtr_unhealthy = ((age - 40) / 100) + 0.5
+    else:        whtr_unhealthy = 0.5
+    if gender == engine.FEMALE:  whr_overweight, whr_obese = 0.8, 0.85
+    elif gender == engine.MALE:  whr_overweight, whr_obese = 0.9, 1
+    else:                        whr_overweight, whr_obese = 0.85, 0.925
+    results = {
+        'basic_bmi': (int(round(bmi, 0)),             [0, 18.5, 25, 30, 40]),
+        'bmi':       (round(bmi, 1),                  [0, 16, 17, 18.5, 25, 30, 35, 40]),
+        'whtr':      (round(waist / height, 2),       [0, whtr_unhealthy]),
+        'whr':       (round(waist / hip, 2),          [0, whr_overweight, whr_obese]),
+        'bri':       (round(bri, 2),                  [0, 3.41, 4.45, 5.46, 6.91]),
+    }
+    classified = {}
+    for metric, (value, thresholds) in results.items():
+        category = 0 if value == value else engine.INVALID
+        for index, threshold in enumerate(thresholds):
+            if value >= threshold:
+                category = index
+        classified[metric] = (value, category)
+    return normalise(classified)
+
+# Undefined values are NaN, which never equals itself, so they are compared
+# as None like the golden file stores them
+def normalise(results):
+    return {
+        metric: (None if value != value else value, category)
+        for metric, (value, category) in results.items()
+    }
+
+# Seeded inputs the way the rows produce them, 0.1 steps and whole years,
+# with a share of them put right next to the thresholds and rounding
+# boundaries
+def generate(count, seed):
+    generator = random.Random(seed)
+    def uniform(name):
+        low, high = ranges[name]
+        return round(generator.uniform(low, high), 1)
+    cases = []
+    for index in range(count):
+        height, mass, waist, hip = (uniform(name) for name in ('height', 'mass', 'waist', 'hip'))
+        age = generator.randint(*ranges['age'])
+        gender = generator.randint(0, 2)
+        kind = index % 4
+        if kind == 1:
+            # BMI on or next to a threshold or a .x5 rounding boundary
+            target = generator.choice([16, 17, 18.5, 25, 30, 35, 40, 18.45, 24.95, 29.95, 39.5])
+            mass = round(target * (height / 100) ** 2 + generator.choice([-0.1, 0, 0.1]), 1)
+            mass = min(max(mass, ranges['mass'][0]), ranges['mass'][1])
+        elif kind == 2:
+            # Waist ratios next to the age and gender dependent thresholds
+            threshold = generator.choice(
+                [engine.get_whtr_unhealthy(age), engine.get_whr_overweight(gender), engine.get_whr_obese(gender)]
+            )
+            waist = round(threshold * height + generator.choice([-0.1, 0, 0.1]), 1)
+            hip = round(waist / threshold + generator.choice([-0.1, 0, 0.1]), 1)
+            waist = min(max(waist, ranges['waist'][0]), ranges['waist'][1])
+            hip = min(max(hip, ranges['hip'][0]), ranges['hip'][1])
+        elif kind == 3:
+            # Around where the BRI square root turns negative, waist = pi * height
+            height = round(generator.uniform(50, 200), 1)
+            waist = round(math.pi * height + generator.choice([-0.2, -0.1, 0, 0.1, 0.2]), 1)
+        cases.append((height, mass, waist, hip, age, gender))
+    return cases
+
+def load_golden():
+    with open(golden_path) as file:
+        return json.load(file)
+
+def as_results(expected):
+    return {metric: tuple(result) for metric, result in expected.items()}
+
+def batch_results(cases, metrics=original):
+    columns = [list(column) for column in zip(*cases)]
+    results = engine.compute_batch(*columns, metrics=metrics)
+    return [
+        normalise({metric: (values[row].item(), int(categories[row])) for metric, (values, categories) in results.items()})
+        for row in range(len(cases))
+    ]
+
+@pytest.mark.parametrize('case', load_golden(), ids=lambda case: case['name'])
+def test_golden_scalar(case):
+    expected = as_results(case['results'])
+    assert reference(*case['inputs']) == expected
+    assert normalise(engine.compute(*case['inputs'], metrics=original)) == expected
+    assert normalise(engine.compute_cached(*case['inputs'], metrics=original)) == expected
+
+@needs_numpy
+def test_golden_batch():
+    cases = load_golden()
+    results = batch_results([case['inputs'] for case in cases])
+    for case, result in zip(cases, results):
+        assert result == as_results(case['results']), case['name']
+
+def test_bri_negative_square_root():
+    # A waist longer than pi * height has no real BRI
+    assert math.isnan(engine.get_bri(50, 200))
+    assert engine.get_bri_reason(50, 200) == engine.BRI_WAIST_TOO_LONG
+    assert normalise(engine.compute(50, 20, 200, 90, 30, 0))['bri'] == (None, engine.INVALID)
+    if np is not None:
+        values, categories = engine.compute_batch([50], [20], [200], [90], [30], [0])['bri']
+        assert math.isnan(values[0]) and categories[0] == engine.INVALID
+
+# Whole number metrics can't hold NaN or infinity, both paths make them
+# undefined instead of casting them to some integer
+def test_undefined_whole_numbers():
+    cases = [(180, 75, 80, 95, math.nan, 2), (180, math.inf, 80, 95, 30, 2)]
+    assert engine.compute(*cases[0], metrics=['bmr'])['bmr'][1] == engine.INVALID
+    results = engine.compute(*cases[1], metrics=['basic_bmi', 'bmr'])
+    assert all(category == engine.INVALID for value, category in results.values())
+    if np is not None:
+        results = batch_results(cases, ['basic_bmi', 'bmr'])
+        for case, result in zip(cases, results):
+            assert result == normalise(engine.compute(*case, metrics=['basic_bmi', 'bmr'])), case
+        valid = batch_results([(180, 75, 80, 95, 30, 2)], ['basic_bmi', 'bmr'])[0]
+        assert valid == {'basic_bmi': (23, 1), 'bmr': (1730, 0)}
+
+# Ideal weight is only defined from 5 feet up and BMR only where it's
+# positive, the window accepts inputs outside of both
+def test_formula_ranges():
+    cases = [
+        (50, 10, 70, 85, 123, engine.FEMALE), (152.3, 45, 70, 85, 30, engine.MALE),
+        (152.4, 45, 70, 85, 30, engine.MALE), (180, 75, 80, 95, 30, engine.AVERAGE),
+    ]
+    metrics = ['bmr', 'ideal_weight']
+    results = [normalise(engine.compute(*case, metrics=metrics)) for case in cases]
+    assert [result['ideal_weight'][0] for result in results] == [None, None, 50.0, 72.7]
+    assert [result['bmr'][0] for result in results] == [None, 1257, 1258, 1647]
+    assert all(result[metric][1] == (engine.INVALID if result[metric][0] is None else 0)
+               for result in results for metric in metrics)
+    if np is not None:
+        assert batch_results(cases, metrics) == results
+
+@needs_numpy
+def test_bri_reasons():
+    height = [180, 50, 0, -10, math.nan, 180, 180, math.inf]
+    waist = [80, 200, 80, 80, 80, -1, math.nan, 80]
+    values, reasons = engine.get_bri_batch(height, waist)
+    assert reasons.tolist() == [engine.get_bri_reason(*row) for row in zip(height, waist)]
+    assert reasons.tolist() == [0, 1, 2, 2, 2, 2, 2, 2]
+    assert not math.isnan(values[0]) and all(math.isnan(value) for value in values[1:])
+
+@needs_numpy
+def test_batch_invalid_count():
+    text = "height,mass,waist\n180,75,80\n50,20,200\n60,20,250\n"
+    output = io.StringIO()
+    assert batch.run(io.StringIO(text), output, 'csv', 'csv') == (3, 2)
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert (rows[1]['bri'], rows[1]['bri_category']) == ('', 'Not defined')
+    assert rows[1]['bri_reason'] == "Waist longer than pi times the height"
+    # Without BRI there is nothing to be undefined and no reason column
+    output = io.StringIO()
+    assert batch.run(io.StringIO(text), output, 'csv', 'csv', metrics=['bmi', 'bsa']) == (3, 0)
+    assert output.getvalue().splitlines()[0] == "height,mass,waist,bmi,bmi_category,bsa"
+
+def test_known_values():
+    results = engine.compute(180, 75, 80, 95, 30, engine.MALE)
+    assert results['absi'] == (0.0734, 0)
+    assert results['bsa'] == (1.94, 0)
+    assert results['bmr'] == (1730, 0)
+    assert results['ideal_weight'] == (75.0, 0)
+    assert engine.compute(180, 75, 80, 95, 30, engine.MALE, metrics=['bmr', 'bmi']) == {
+        'bmi': results['bmi'], 'bmr': results['bmr'],
+    }
+    with pytest.raises(ValueError):
+        engine.compute(180, 75, 80, 95, 30, engine.MALE, metrics=['bmj'])
+
+# The metrics outside the reference have to agree between the scalar and the
+# vectorized path, including the near-boundary fallback of the inexact ones
+@needs_numpy
+def test_new_metrics_batch():
+    metrics = [metric for metric in engine.METRICS if metric not in original]
+    cases = generate(min(rows, 100000), seed=5)
+    for case, result in zip(cases, batch_results(cases, metrics)):
+        assert result == normalise(engine.compute(*case, metrics=metrics)), case
+
+def test_scalar_paths():
+    for case in generate(rows, seed=1):
+        expected = reference(*case)
+        assert normalise(engine.compute(*case, metrics=original)) == expected, case
+        assert normalise(engine.compute_cached(*case, metrics=original)) == expected, case
+
+# The window keeps metric values and only shows them converted, results for
+# the same values given in inches and pounds have to be the ones of the
+# metric values, so toggling units never changes a result
+def test_imperial_path():
+    for case in generate(rows // 4, seed=2):
+        height, mass, waist, hip, age, gender = case
+        imperial = (engine.cm_to_in(height), engine.kg_to_lb(mass), engine.cm_to_in(waist), engine.cm_to_in(hip))
+        expected = normalise(engine.compute(*case))
+        assert normalise(engine.compute_cached(*imperial, age, gender, True)) == expected, case
+        assert normalise(engine.compute_cached(*case)) == expected, case
+
+@needs_numpy
+def test_batch_path():
+    chunk = 100000
+    for first in range(0, rows, chunk):
+        cases = generate(min(chunk, rows - first), seed=3 + first)
+        for case, result in zip(cases, batch_results(cases)):
+            assert result == reference(*case), case
+
+@needs_numpy
+def test_batch_records():
+    cases = generate(min(rows, 50000), seed=4)
+    genders = {index: name for name, index in engine.GENDERS.items()}
+    records = [
+        dict(zip(engine.INPUTS, [str(value) for value in case[:5]] + [genders[case[5]]]))
+        for case in cases
+    ]
+    batch.score(records, metrics=original)
+    for case, record in zip(cases, records):
+        for metric, (value, category) in reference(*case).items():
+            assert record[metric] == value, (case, metric)
+            assert record[f'{metric}_category'] == engine.get_label(metric, category), (case, metric)
+        assert record['bri_reason'] == engine.BRI_REASONS[engine.get_bri_reason(case[0], case[2])]
+
+# Property based tests, when Hypothesis is installed
+try:
+    from hypothesis import given, settings, strategies
+except ImportError:
+    given = None
+
+if given is not None:
+    def tenths(name):
+        low, high = ranges[name]
+        return strategies.integers(low * 10, high * 10).map(lambda value: value / 10)
+
+    inputs = strategies.tuples(
+        tenths('height'), tenths('mass'), tenths('waist'), tenths('hip'),
+        strategies.integers(*ranges['age']), strategies.integers(0, 2),
+    )
+
+    @settings(max_examples=2000, deadline=None)
+    @given(inputs)
+    def test_property_scalar(case):
+        expected = reference(*case)
+        assert normalise(engine.compute(*case, metrics=original)) == expected
+        assert normalise(engine.compute_cached(*case, metrics=original)) == expected
+
+    @needs_numpy
+    @settings(max_examples=200, deadline=None)
+    @given(strategies.lists(inputs, min_size=1, max_size=200))
+    def test_property_batch(cases):
+        for case, result in zip(cases, batch_results(cases)):
+            assert result == reference(*case)
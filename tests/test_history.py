@@ -0,0 +1,90 @@
+# test_history.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+
+# Tests of the measurement history's queries on an in-memory database
+
+# Imports
+import calendar
+import time
+import pytest
+from bmi import history
+
+# Seconds since the epoch of a UTC time
+def get_time(year, month, day, hour=0):
+    return calendar.timegm((year, month, day, hour, 0, 0))
+
+@pytest.fixture
+def entries(monkeypatch):
+    # Months are grouped in local time, UTC here
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    instance = history.History(':memory:')
+    instance.append([
+        {'time': get_time(2024, 1, 20, 23), 'height': 180, 'mass': 80, 'bmi': 24.7, 'bri': None},
+        {'time': get_time(2024, 1, 1), 'height': 180, 'mass': 78, 'bmi': 24.1, 'bri': 3.2},
+        {'time': get_time(2024, 2, 1), 'height': 180, 'mass': 76, 'bmi': 23.5, 'bri': None},
+        {'time': get_time(2024, 3, 15), 'height': 180, 'mass': 75, 'bmi': 23.1, 'bri': 2.9},
+    ])
+    yield instance
+    instance.close()
+    monkeypatch.undo()
+    time.tzset()
+
+def test_range(entries):
+    january, february, march = get_time(2024, 1, 1), get_time(2024, 2, 1), get_time(2024, 3, 1)
+    # Oldest first, the start is included and the end is not
+    assert [row[0] for row in entries.range(january, february)] == [january, get_time(2024, 1, 20, 23)]
+    assert list(entries.range(february, march, ['mass', 'bri'])) == [(february, 76.0, None)]
+    assert len(list(entries.range())) == 4
+    assert entries.count(january, february) == 2
+    assert entries.count(february, february) == 0
+    assert entries.count() == 4
+    with pytest.raises(ValueError):
+        list(entries.range(columns=['bmi; DROP TABLE measurements']))
+
+def test_last(entries):
+    last = entries.last()
+    assert last[0] == get_time(2024, 3, 15)
+    assert dict(zip(['time'] + history.COLUMNS, last))['mass'] == 75
+    assert history.History(':memory:').last() is None
+
+def test_monthly(entries):
+    assert entries.monthly('bmi') == [
+        ('2024-01', 24.1, 24.7, pytest.approx(24.4), 2),
+        ('2024-02', 23.5, 23.5, 23.5, 1),
+        ('2024-03', 23.1, 23.1, 23.1, 1),
+    ]
+    # Entries without a BRI are left out of its aggregates
+    assert entries.monthly('bri') == [
+        ('2024-01', 3.2, 3.2, 3.2, 1),
+        ('2024-02', None, None, None, 0),
+        ('2024-03', 2.9, 2.9, 2.9, 1),
+    ]
+    assert entries.monthly('bmi', get_time(2024, 2, 1), get_time(2024, 3, 15)) == [('2024-02', 23.5, 23.5, 23.5, 1)]
+
+def test_buckets(entries):
+    start, end = get_time(2024, 1, 1), get_time(2024, 3, 1)
+    assert entries.buckets('bmi', start, end, 2) == [(0, 24.1, 24.7), (1, 23.5, 23.5)]
+    # Entries without a value don't make up a bucket
+    assert entries.buckets('bri', start, end, 2) == [(0, 3.2, 3.2)]
+    assert entries.buckets('bmi', end, get_time(2024, 4, 1), 1) == [(0, 23.1, 23.1)]
+    with pytest.raises(ValueError):
+        entries.buckets('time', start, end, 2)
@@ -0,0 +1,117 @@
+# test_labels.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Tests of the per-language label tables and the translated batch columns,
+# against a catalog written for the test as the po/ ones are only compiled
+# when installing
+
+# Imports
+import csv
+import gettext
+import io
+import os
+import struct
+import pytest
+from bmi import batch, engine, labels
+
+catalog = {
+    'Healthy': "Sain",
+    'Overweight': "Surpoids",
+    'Not defined': "Non défini",
+    'Body Mass Index': "Indice de masse corporelle",
+    'Waist longer than pi times the height': "Tour de taille plus long que pi fois la taille",
+}
+
+# Writes a GNU .mo file of the given messages
+def write_mo(path, messages):
+    messages = dict(messages, **{'': "Content-Type: text/plain; charset=UTF-8\n"})
+    keys = sorted(messages)
+    ids = [key.encode() for key in keys]
+    strs = [messages[key].encode() for key in keys]
+    count = len(keys)
+    ids_start = 7 * 4 + 16 * count
+    offsets = []
+    position = ids_start
+    for id in ids:
+        offsets += [len(id), position]
+        position += len(id) + 1
+    for string in strs:
+        offsets += [len(string), position]
+        position += len(string) + 1
+    header = struct.pack('<7I', 0x950412de, 0, count, 7 * 4, 7 * 4 + 8 * count, 0, 0)
+    with open(path, 'wb') as file:
+        file.write(header + struct.pack(f'<{4 * count}I', *offsets))
+        file.write(b''.join(id + b'\0' for id in ids) + b''.join(string + b'\0' for string in strs))
+
+@pytest.fixture
+def french(tmp_path):
+    directory = tmp_path / 'fr' / 'LC_MESSAGES'
+    os.makedirs(directory)
+    write_mo(directory / 'bmi.mo', catalog)
+    bound = gettext.bindtextdomain(labels.domain)
+    gettext.bindtextdomain(labels.domain, str(tmp_path))
+    labels.clear_cache()
+    yield
+    gettext.bindtextdomain(labels.domain, bound)
+    labels.clear_cache()
+
+def test_tables(french):
+    table = labels.get_table('fr')
+    assert labels.get_table('fr') is table
+    assert labels.get_languages() == ['en', 'fr']
+    assert table.get_label('bmi', 3) == "Sain"
+    assert table.get_label('bri', engine.INVALID) == "Non défini"
+    assert table.descriptions['bmi'] == "Indice de masse corporelle"
+    assert table.reasons[engine.BRI_WAIST_TOO_LONG] == catalog['Waist longer than pi times the height']
+    # Untranslated messages and the empty texts of metrics without bands
+    # stay as they are instead of becoming the catalog header
+    assert table.get_label('bmi', 0) == "Underweight [Severe]"
+    assert table.get_label('bsa', 0) == ""
+    assert labels.get_table('de').get_label('bmi', 3) == "Healthy"
+
+@pytest.mark.skipif(engine.np is None, reason="NumPy is not installed")
+def test_batch_languages(french):
+    text = "height,mass,waist\n180,75,80\n50,20,200\n"
+    output = io.StringIO()
+    batch.run(io.StringIO(text), output, 'csv', 'csv', metrics=['bmi', 'bri'], languages=['fr', 'de'])
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert list(rows[0]) == [
+        'height', 'mass', 'waist', 'bmi', 'bmi_category', 'bmi_category_fr', 'bmi_category_de',
+        'bri', 'bri_category', 'bri_category_fr', 'bri_category_de',
+        'bri_reason', 'bri_reason_fr', 'bri_reason_de',
+    ]
+    assert (rows[0]['bmi_category'], rows[0]['bmi_category_fr'], rows[0]['bmi_category_de']) == (
+        "Healthy", "Sain", "Healthy"
+    )
+    assert (rows[1]['bri_category_fr'], rows[1]['bri_reason_fr']) == (
+        "Non défini", catalog['Waist longer than pi times the height']
+    )
+
+def test_arrow_languages(french):
+    pa = pytest.importorskip('pyarrow')
+    if engine.np is None:
+        pytest.skip("NumPy is not installed")
+    text = "height,mass,waist\n180,75,80\n50,20,200\n"
+    output = io.BytesIO()
+    batch.run(io.StringIO(text), output, 'csv', 'arrow', metrics=['bmi', 'bri'], languages=['fr'])
+    table = pa.ipc.open_file(pa.BufferReader(output.getvalue())).read_all().to_pydict()
+    assert table['bmi_category_fr'] == ["Sain", "Obese [Class 3]"]
+    assert table['bri_category_fr'] == [table['bri_category_fr'][0], None]
+    assert table['bri_reason_fr'] == [None, catalog['Waist longer than pi times the height']]
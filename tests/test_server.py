@@ -0,0 +1,134 @@
+# test_server.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# Tests of the HTTP server on a free port of this host, concurrent requests
+# have to come back with the results of the batch mode for their own records
+
+# Imports
+import asyncio
+import json
+import pytest
+from bmi import batch, engine, server
+
+pytestmark = pytest.mark.skipif(engine.np is None, reason="NumPy is not installed")
+
+async def request(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    response = await reader.read()
+    writer.close()
+    head, _separator, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+# Runs the given coroutine function against a served Server
+def serve(instance, client):
+    async def run():
+        stop = asyncio.Event()
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(instance.serve('127.0.0.1', 0, stop, ready.set_result))
+        try:
+            return await client(await ready)
+        finally:
+            stop.set()
+            await task
+    return asyncio.run(run())
+
+def test_micro_batches():
+    records = [
+        {'height': 150 + index, 'mass': 50 + index, 'waist': 80, 'gender': 'female'}
+        for index in range(20)
+    ]
+    instance = server.Server(max_batch=8, max_wait=0.05)
+    async def client(port):
+        responses = await asyncio.gather(
+            *[request(port, 'POST', '/compute', record) for record in records[:-2]],
+            request(port, 'POST', '/compute', records[-2:]),
+        )
+        return responses, await request(port, 'GET', '/stats')
+    responses, (status, stats) = serve(instance, client)
+    expected = batch.score([dict(record) for record in records])
+    for response, record in zip(responses, expected):
+        status, result = response
+        if isinstance(result, list):
+            result = result[0]
+        assert status == 200
+        assert result == {column: record[column] for column in batch.RESULTS}
+    assert responses[-1][1][1] == {column: expected[-1][column] for column in batch.RESULTS}
+    assert stats['requests'] == 19 and stats['rows'] == 20
+    assert 1 < stats['batches'] < 19
+    assert stats['p50_ms'] <= stats['p99_ms']
+
+def test_errors():
+    instance = server.Server(metrics=['bmi'])
+    async def client(port):
+        return await asyncio.gather(
+            request(port, 'POST', '/compute', {'height': 180}),
+            request(port, 'POST', '/compute', [180, 75]),
+            request(port, 'GET', '/compute'),
+            request(port, 'GET', '/nothing'),
+            request(port, 'POST', '/compute', {'height': 180, 'mass': 75, 'gender': 1e30}),
+            request(port, 'POST', '/compute', {'height': 0, 'mass': 75}),
+            request(port, 'POST', '/compute', {'height': 1e-200, 'mass': 75}),
+            request(port, 'POST', '/compute', {'height': 180, 'mass': 75}),
+        )
+    responses = serve(instance, client)
+    assert [status for status, payload in responses] == [400, 400, 405, 404, 400, 400, 200, 200]
+    assert responses[0][1] == {'error': "record 1: missing 'mass'"}
+    assert responses[4][1] == {'error': "record 1: unknown gender '1e+30'"}
+    assert responses[6][1]['bmi'] is None
+    assert responses[-1][1] == {'bmi': 23.1, 'bmi_category': "Healthy"}
+
+# Sends raw bytes and returns (status, JSON response)
+async def send(port, data):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(data)
+    response = await reader.read()
+    writer.close()
+    head, _separator, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+# Malformed requests are answered instead of dropping the connection
+def test_malformed_requests():
+    instance = server.Server()
+    async def client(port):
+        return await asyncio.wait_for(asyncio.gather(
+            send(port, b"POST /compute HTTP/1.1\r\nContent-Length: -5\r\n\r\n"),
+            send(port, b"POST /compute HTTP/1.1\r\nX-Padding: " + b"x" * 100000 + b"\r\n\r\n"),
+            send(port, b"GET /stats HTTP/1.1 extra\r\n\r\n"),
+        ), 5)
+    responses = serve(instance, client)
+    assert responses == [(400, {'error': "malformed request"})] * 3
+
+# A batch failing to score answers all of its requests with the error
+def test_failed_batch(monkeypatch):
+    def fail(*args, **kwargs):
+        raise OverflowError("too large")
+    monkeypatch.setattr(engine, 'compute_batch', fail)
+    instance = server.Server(max_batch=4, max_wait=0.05)
+    async def client(port):
+        return await asyncio.wait_for(asyncio.gather(
+            *[request(port, 'POST', '/compute', {'height': 180, 'mass': 75}) for index in range(6)]
+        ), 5)
+    responses = serve(instance, client)
+    assert responses == [(500, {'error': "could not score the records: too large"})] * 6
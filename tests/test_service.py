@@ -0,0 +1,122 @@
+# test_service.py
+#
+# Copyright 2024 philipp
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+
+# Tests of the D-Bus interface on a private bus of its own dbus-daemon, so
+# neither the session bus nor an installed application is needed
+
+# Imports
+import shutil
+import pytest
+from bmi import engine
+
+gi = pytest.importorskip('gi')
+if shutil.which('dbus-daemon') is None:
+    pytest.skip("dbus-daemon is not installed", allow_module_level=True)
+from gi.repository import Gio, GLib
+from bmi import service
+
+object_path = '/io/github/philippkosarev/bmi'
+
+# Stands in for the Adw.Application holding itself during calls
+class Application:
+    def __init__(self):
+        self.holds = 0
+
+    def hold(self):
+        self.holds += 1
+
+    def release(self):
+        self.holds -= 1
+
+@pytest.fixture
+def connection():
+    bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+    bus.up()
+    connection = Gio.DBusConnection.new_for_address_sync(
+        bus.get_bus_address(),
+        Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION,
+        None, None,
+    )
+    yield connection
+    connection.close_sync(None)
+    bus.down()
+
+# Calls a method of the registered object, whose handler runs in this
+# thread's main loop. Returns the unpacked result or raises the GLib.Error.
+def call(connection, method, parameters=None):
+    loop = GLib.MainLoop()
+    outcome = {}
+    def done(connection, result):
+        try:
+            outcome['value'] = connection.call_finish(result).unpack()
+        except GLib.Error as error:
+            outcome['error'] = error
+        loop.quit()
+    connection.call(
+        connection.get_unique_name(), object_path, service.interface_name, method,
+        parameters, None, Gio.DBusCallFlags.NONE, 5000, None, done,
+    )
+    loop.run()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+def compute_parameters(height, mass):
+    rows = len(height)
+    return GLib.Variant('(adadadadadai)', (height, mass, [80.0] * rows, [95.0] * rows, [30.0] * rows, [1] * rows))
+
+def test_compute(connection):
+    application = Application()
+    calculator = service.CalculatorService(application)
+    calculator.register(connection, object_path)
+    values, categories = call(connection, 'Compute', compute_parameters([180.0, 170.0], [75.0, 90.0]))
+    expected = engine.compute(180.0, 75.0, 80.0, 95.0, 30.0, 1)
+    assert values['bmi'][0] == expected['bmi'][0]
+    assert categories['bmi'][0] == expected['bmi'][1]
+    assert len(values['bri']) == 2
+    bands = call(connection, 'GetBands')[0]
+    assert bands['bmi'] == [text for text, style in engine.REGISTRY['bmi'].bands]
+    assert application.holds == 0
+
+@pytest.mark.parametrize('failure, name', [
+    (ValueError("bad input"), 'org.freedesktop.DBus.Error.InvalidArgs'),
+    (ZeroDivisionError("float division by zero"), 'org.freedesktop.DBus.Error.Failed'),
+])
+def test_errors(connection, monkeypatch, failure, name):
+    def fail(*args, **kwargs):
+        raise failure
+    application = Application()
+    calculator = service.CalculatorService(application)
+    monkeypatch.setattr(calculator, 'compute', fail)
+    calculator.register(connection, object_path)
+    with pytest.raises(GLib.Error) as error:
+        call(connection, 'Compute', compute_parameters([180.0], [75.0]))
+    assert Gio.DBusError.get_remote_error(error.value) == name
+    assert str(failure) in error.value.message
+    assert application.holds == 0
+
+def test_mismatched_lengths(connection):
+    calculator = service.CalculatorService(Application())
+    calculator.register(connection, object_path)
+    parameters = GLib.Variant('(adadadadadai)', ([180.0], [], [], [], [], []))
+    with pytest.raises(GLib.Error) as error:
+        call(connection, 'Compute', parameters)
+    assert Gio.DBusError.get_remote_error(error.value) == 'org.freedesktop.DBus.Error.InvalidArgs'
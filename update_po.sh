@@ -1,7 +1,7 @@
 #!/bin/bash
 
 echo "Updating pot file."
-xgettext --files-from=po/POTFILES.in --output=po/bmi.pot --join-existing --omit-header
+xgettext --files-from=po/POTFILES.in --output=po/bmi.pot --join-existing --omit-header --keyword=N_
 po_files=($(find ./po/ -name *.po))
 echo "Updating: ${po_files[@]}"
 for file in ${po_files[@]}; do